@@ -0,0 +1,68 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# CONSTANTS
+
+# modules used by extraction runs (and their workers), which must stay light to import
+EXTRACTION_MODULES = ["helperFunctions", "extractSamples", "pwmScanner", "genomeStore", "intervalIndex",
+                      "motifLibrary", "shapeFeatures", "instrumentation", "sampleTable",
+                      "sequenceCache"]
+
+# packages none of them may import
+HEAVY_MODULES = ["pandas", "sklearn", "scipy", "matplotlib", "seaborn"]
+
+# maximum import time (seconds) of each module, measured in a fresh interpreter
+IMPORT_BUDGET = 1.0
+
+# folder the modules are imported from
+curr = os.path.dirname(os.path.abspath(__file__))
+
+# code run in the fresh interpreter: import the module, report time taken and heavy packages loaded
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def checkModule(module, heavy=HEAVY_MODULES):
+    """
+    Imports a module in a fresh interpreter and returns how long it took and which heavy packages it pulled in.
+
+    Returns:
+        (dict): {"seconds": import time, "heavy": list of heavy packages loaded}
+    """
+    result = subprocess.run([sys.executable, "-c", _PROBE.format(module=module, heavy=heavy)], cwd=curr,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that the extraction modules import quickly and without pandas/sklearn/plotting.")
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET, help="maximum import time (s) of each module")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for module in EXTRACTION_MODULES:
+        result = checkModule(module)
+        problems = []
+        if result["heavy"]:
+            problems.append(f"imports {', '.join(result['heavy'])}")
+        if result["seconds"] > args.budget:
+            problems.append(f"over the {args.budget:.2f}s budget")
+        failures += bool(problems)
+        print(f"{'FAIL' if problems else 'ok':<5}{module:<18}{result['seconds']*1000:8.1f} ms   {'; '.join(problems)}")
+
+    if failures:
+        print(f"\n{failures} module(s) failed the import check")
+    return 1 if failures else 0
+
+if (__name__=="__main__"):
+    sys.exit(main())
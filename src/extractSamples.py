@@ -1,14 +1,68 @@
-import time
 import os
-from Bio import motifs, SeqIO
+import json
+import zlib
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import helperFunctions as hf
+import pwmScanner as ps
+import genomeStore as gs
+import motifLibrary as ml
+import shapeFeatures as sf
+import instrumentation as ins
+import negativeSampler as ns
+import sampleTable as st
+import sequenceCache as sc
 
 # CONSTANTS
 
 # threshold for PWM search, change as needed
 PWM_THRESH = 3.0
 
+# maximum distance (in bp) between a PWM hit and a bound site start for the hit to count as a positive sample
+# 0 means the start positions must match exactly
+MATCH_TOLERANCE = 0
+
+# whether to gzip the output FASTA files
+COMPRESS_OUTPUT = False
+
+# whether to also save the samples of each (TF, chromosome) as a columnar table (coordinates, strand, PWM score,
+# label and encoded sequence, one .npy file per column, see sampleTable.py)
+COLUMNAR_OUTPUT = False
+
+# strand(s) to look for motifs on: '+' for the positive strand only, 'both' to also scan the reverse complement
+# of each motif in the same pass (negative strand samples are written out reverse complemented)
+STRAND = '+'
+
+# how negative samples are picked from the unbound hits:
+# 'first' takes the first ones in scan order, 'matched' draws a seeded sample matched to the positives' GC content
+# and PWM score (the candidates are indexed per unit, so the ratio and seed can be changed without rescanning)
+NEGATIVES = 'first'
+
+# number of negative samples per positive sample (1 for 1:1, 5 for 1:5 etc)
+NEG_RATIO = 1
+
+# seed of the matched negative sampling
+SEED = 0
+
+# maximum number of unbound hits held back per TF while waiting for enough positives to balance them
+# (bounds the memory of the streaming pipeline)
+MAX_PENDING_NEGATIVES = 10**6
+
+# instrumentation: run every extraction unit under cProfile (one .prof file per unit in the profiles/ subfolder)
+# and/or trace Python memory allocations with tracemalloc (both slow things down)
+PROFILE = False
+TRACE_MEMORY = False
+
+# number of worker processes to spread the (TF, chromosome) extraction units over
+# 1 runs everything in this process
+WORKERS = 1
+
+# number of chromosomes loaded ahead on a background thread while the current one is scanned (0 disables)
+# (only when units run in this process; each worker process loads its own chromosomes)
+PREFETCH = gs.PREFETCH_DEPTH
+
 # list of chromosomes to check on for each transcription factor
 # add any chromosomes you'd like to check to this list
 # NB: they must exist in the hg19 folder
@@ -19,149 +73,509 @@ curr = os.path.dirname(__file__)
 DATA_FOLDER = os.path.join(curr, "../data/")
 OUT_FOLDER = os.path.join(curr, "../outputs/")
 CHR_FOLDER = DATA_FOLDER + "hg19/"
+# chromosomes converted with genomeStore.py are memory-mapped from here instead of parsed from CHR_FOLDER
+STORE_FOLDER = DATA_FOLDER + "hg19_store/"
+
+# bump this when the content of the unit files changes, so old checkpoints are treated as stale
+UNIT_VERSION = 2
 
 # list of transcription factors to extract samples for
 # add any TF's you'd like to extract samples for to this list
 # my project focused on the UAK42 transcription factor, hence its inclusion here
 tfs = ['UAK42']
 
-if (__name__=="__main__"):
-    # write Jaspar files for the PWM of the chosen transcription factors
-    for TF in tfs:
-        hf.writePWMJaspar(TF)
+def scanStage(encoded, logodds, active_regions, threshold, stats, strand=STRAND):
+    """
+    First pipeline stage: scans the active regions for all TFs in one pass, yielding (TF, positions, scores, strands)
+    chunks of hits in scan order. Keeps running hit counts and the best hit of each TF in stats.
+    With strand='both', the reverse complement of every motif is scored in the same pass.
+    """
+    # same windows as the previous per-region pssm.search() calls, which searched
+    # sequence[start:end-len(motif)] and skipped the hit at offset 0 of each region
+    scan_regions = lambda motif_len: active_regions + [1, -motif_len]
+    for TF, positions, scores, strands in ps.iterScanRegionsMulti(encoded, logodds, scan_regions, threshold, both=(strand == "both")):
+        tf_stats = stats.setdefault(TF, {"hits": 0, "best_score": -np.inf, "best_pos": None, "best_strand": 1})
+        tf_stats["hits"] += len(positions)
+        if (len(positions) != 0 and scores.max() > tf_stats["best_score"]):
+            best = np.argmax(scores)
+            tf_stats["best_score"] = float(scores[best])
+            tf_stats["best_pos"] = int(positions[best])
+            tf_stats["best_strand"] = int(strands[best])
+        yield TF, positions, scores, strands
+
+def labelStage(hits, chromosome, tolerance):
+    """
+    Second pipeline stage: labels every chunk of hits as bound or not, yielding (TF, positions, scores, strands, is_bound)
+    chunks. A hit is only bound if it matches a binding site on its own strand.
+    """
+    for TF, positions, scores, strands in hits:
+        is_bound = np.zeros(len(positions), dtype=bool)
+        for strand, sign in (("+", 1), ("-", -1)):
+            on_strand = strands == sign
+            if on_strand.any():
+                # locations of bound binding sites from factorbookMotifPos file (indexed once per process)
+                bs_locs = hf.getBindingSiteLocs(TF, chromosome, strand=strand)
+                is_bound[on_strand] = hf.labelHits(positions[on_strand], bs_locs[:, 0], tolerance=tolerance)
+        yield TF, positions, scores, strands, is_bound
+
+def balanceStage(labelled, max_pending=MAX_PENDING_NEGATIVES, ratio=NEG_RATIO):
+    """
+    Third pipeline stage: picks the samples out of each chunk of labelled hits, yielding
+    (TF, pos_starts, pos_strands, neg_starts, neg_strands).
+    All bound hits are positive samples. The negative samples are the first unbound hits in scan order, ratio times as
+    many as there are positives, exactly like taking positions[~is_bound][:num_positives*ratio] over the whole chromosome.
+    Unbound hits are held back (as positions and strands only) until enough positives have been seen to use them;
+    at most max_pending of them are kept, which bounds memory use.
+    """
+    n_pos, n_neg, pending = {}, {}, {}
+    for TF, positions, _, strands, is_bound in labelled:
+        pos_starts, pos_strands = positions[is_bound], strands[is_bound]
+        n_pos[TF] = n_pos.get(TF, 0) + len(pos_starts)
+        n_neg.setdefault(TF, 0)
+        held_starts, held_strands = pending.get(TF, (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8)))
+        cand_starts = np.concatenate((held_starts, positions[~is_bound]))[:max_pending]
+        cand_strands = np.concatenate((held_strands, strands[~is_bound]))[:max_pending]
+        take = min(int(n_pos[TF] * ratio) - n_neg[TF], len(cand_starts))
+        pending[TF] = (cand_starts[take:], cand_strands[take:])
+        n_neg[TF] += take
+        yield TF, pos_starts, pos_strands, cand_starts[:take], cand_strands[:take]
+
+def indexStage(labelled, encoded, logodds, samplers):
+    """
+    Third pipeline stage when negatives are 'matched': passes the positive samples on, yielding
+    (TF, pos_starts, pos_strands, neg_starts, neg_strands) with no negatives, and adds the unbound hits
+    to each TF's NegativeSampler (bucketed by GC content and PWM score) for the negatives to be drawn later.
+    """
+    for TF, positions, scores, strands, is_bound in labelled:
+        gc = ns.windowGC(encoded, positions, logodds[TF].shape[0])
+        samplers[TF].addPositives(gc[is_bound], scores[is_bound])
+        samplers[TF].addCandidates(positions[~is_bound], strands[~is_bound], gc[~is_bound], scores[~is_bound])
+        none = np.empty(0, dtype=np.int64)
+        yield TF, positions[is_bound], strands[is_bound], none, none.astype(np.int8)
+
+def drawNegatives(candidates_file, encoded, motif_len, out_path, ratio=NEG_RATIO, seed=SEED, table=None, logodds=None):
+    """
+    Draws matched negative samples from a unit's saved NegativeSampler index and writes their sequences to
+    out_path (one per line, in position order), like the negative unit file of a 'first' run.
+    If table (a sampleTable.TableWriter) is given, the negatives are also added to it, scored with the TF's logodds.
+
+    Returns:
+        (int): Number of negatives drawn
+    """
+    starts, strands = ns.NegativeSampler.load(candidates_file).draw(ratio, seed)
+    codes = ps.encodeWindows(encoded, starts, motif_len, strands)
+    with open(out_path + ".tmp", "wb") as f:
+        if (len(starts) != 0):
+            f.write(b"\n".join(ps.windowsToBytes(codes)) + b"\n")
+    os.replace(out_path + ".tmp", out_path)
+    if table is not None:
+        table.writeRows(starts, strands, ps.windowScores(encoded, starts, logodds, strands), 0, codes)
+    return len(starts)
+
+def writeStage(balanced, encoded, logodds, part_files, tables=None):
+    """
+    Last pipeline stage: writes the sequences of each chunk of samples to the TF's part files (negative strand
+    samples reverse complemented, so every sample reads 5'->3' along its motif), yielding
+    (TF, num_positives, num_negatives) for each chunk written.
+    If tables is given (TF name -> (positive, negative) sampleTable.TableWriter), the samples are also added to
+    the TF's tables along with their coordinates, strand and PWM score.
+    """
+    for TF, pos_starts, pos_strands, neg_starts, neg_strands in balanced:
+        motif_len = logodds[TF].shape[0]
+        for i, (starts, strands) in enumerate(((pos_starts, pos_strands), (neg_starts, neg_strands))):
+            if (len(starts) != 0):
+                codes = ps.encodeWindows(encoded, starts, motif_len, strands)
+                part_files[TF][i].write(b"\n".join(ps.windowsToBytes(codes)) + b"\n")
+                if tables is not None and tables[TF][i] is not None:
+                    tables[TF][i].writeRows(starts, strands, ps.windowScores(encoded, starts, logodds[TF], strands), 1 - i, codes)
+        yield TF, len(pos_starts), len(neg_starts)
+
+def extractUnit(chromosome, logodds, part_files, threshold=PWM_THRESH, tolerance=MATCH_TOLERANCE, metrics=None, strand=STRAND,
+                negatives=NEGATIVES, ratio=NEG_RATIO, tables=None, encoded=None):
+    """
+    Extracts the positive and negative samples of one or more transcription factors (TFs) on one chromosome.
+    Runs as a streaming pipeline of generator stages (scan -> label -> balance -> write) over chunks of hits,
+    so memory use is bounded by the chunk size rather than the number of hits, and samples are written out
+    while the scan is still going. The active regions are scanned once for all the TFs together.
+    Units are independent of each other, so they can be run in separate processes.
+
+    Args:
+        chromosome (str): Name of the chromosome
+        logodds (dict): Mapping of TF name -> log-odds matrix of its PWM, shape (motif length, 4)
+        part_files (dict): Mapping of TF name -> (positive, negative) open binary files the sample sequences
+                           are written to, one per line, in scan order. With 'matched' negatives, the TF's
+                           NegativeSampler index is saved to the negative file instead.
+        threshold (float): Threshold for the PWM search
+        tolerance (int): Maximum distance (in bp) between a PWM hit and a bound site start for the hit to count as a positive sample
+        metrics (instrumentation.Metrics): Where the timings of the stages are recorded. Default is a new one.
+        strand (str): '+' to only look for motifs on the positive strand, 'both' for both strands
+        negatives (str): 'first' or 'matched' (see NEGATIVES)
+        ratio (float): Number of negative samples per positive sample ('first' negatives only; matched ones are
+                       drawn from the index afterwards)
+        tables (dict): Mapping of TF name -> (positive, negative) sampleTable.TableWriter the samples are also
+                       written to (negative is None with 'matched' negatives). If None, no tables are written.
+        encoded (np.array): The encoded chromosome, if already loaded (e.g. by genomeStore.prefetchChromosomes())
+
+    Returns:
+        log (list): Lines of logging output for the unit
+    """
+    log = []
+    if metrics is None:
+        metrics = ins.Metrics(chromosome=chromosome, tfs=list(logodds))
+
+    with metrics.stage("unit") as unit:
+        # get encoded DNA sequence from the genome store (or chromosome FASTA file if not converted)
+        with metrics.stage("load_chromosome") as stage:
+            if encoded is None:
+                encoded = gs.loadChromosome(chromosome, CHR_FOLDER, STORE_FOLDER)
+            stage.add(len(encoded))
+
+        # get active regions for chromosome
+        with metrics.stage("active_regions") as stage:
+            active_regions = np.asarray(hf.getActiveRegions(chromosome), dtype=np.int64).reshape(-1, 2)
+            stage.add(len(active_regions))
+
+        # logging
+        log.append(f"{chromosome}: {len(encoded):,} nucleotides ------------------------")
+        log.append(f"Searching for potential {', '.join(logodds)} binding sites on {chromosome} active regions...\n")
+
+        # scan -> label -> balance -> write, each stage timed on its own
+        stats = {}
+        counts = {TF: [0, 0] for TF in logodds}
+        hits = metrics.timedIter("scan", scanStage(encoded, logodds, active_regions, threshold, stats, strand), count=lambda c: len(c[1]))
+        labelled = metrics.timedIter("label", labelStage(hits, chromosome, tolerance), count=lambda c: len(c[1]))
+        if (negatives == "matched"):
+            samplers = {TF: ns.NegativeSampler(threshold) for TF in logodds}
+            balanced = metrics.timedIter("index", indexStage(labelled, encoded, logodds, samplers), count=lambda c: len(c[1]))
+        else:
+            balanced = metrics.timedIter("balance", balanceStage(labelled, ratio=ratio), count=lambda c: len(c[1]) + len(c[3]))
+        for TF, n_pos, n_neg in metrics.timedIter("write", writeStage(balanced, encoded, logodds, part_files, tables), count=lambda c: c[1] + c[2]):
+            counts[TF][0] += n_pos
+            counts[TF][1] += n_neg
+        if (negatives == "matched"):
+            with metrics.stage("save_index") as stage:
+                for TF, sampler in samplers.items():
+                    sampler.save(part_files[TF][1])
+                    stage.add(len(sampler))
+        unit.add(sum(sum(c) for c in counts.values()))
+
+    # logging
+    for TF in logodds:
+        tf_stats = stats.get(TF, {"hits": 0})
+        log.append(f"{tf_stats['hits']:,} potential {TF} TFBS's found on {chromosome} active regions")
+        if (tf_stats["hits"] != 0):
+            best, best_strand = tf_stats["best_pos"], tf_stats["best_strand"]
+            best_seq = ps.decodeWindows(encoded, [best], logodds[TF].shape[0], [best_strand])[0].decode()
+            on_strand = f" ({'+' if best_strand > 0 else '-'} strand)" if strand == "both" else ""
+            log.append(f"Highest score: {tf_stats['best_score']:.3f} at position {best:,}{on_strand} giving sequence {best_seq}")
+        n_bound = len(hf.getBindingSiteLocs(TF, chromosome, strand=None if strand == "both" else "+"))
+        log.append(f"{n_bound:,} bound {TF} TFBS's on {chromosome} found in factorbookMotifPos")
+        if (negatives == "matched"):
+            log.append(f"Extracted {counts[TF][0]} positive {TF} samples, indexed {len(samplers[TF])} candidate negatives\n")
+        else:
+            log.append(f"Extracted {counts[TF][0]} positive and {counts[TF][1]} negative {TF} samples\n")
+
+    # logging time for current chromosome
+    log.append(f"Total time for {chromosome}: {hf.stringTime(0, unit.wall)}\n")
+
+    return log
+
+def unitKey(TF, chromosome, logodds, threshold, tolerance, strand=STRAND, negatives=NEGATIVES, ratio=NEG_RATIO):
+    """
+    Returns a hash of everything the result of an extraction unit depends on (settings, PWM and input files),
+    used to tell whether a checkpointed unit is still up to date.
+    """
+    source = gs.chromosomeSource(chromosome, CHR_FOLDER, STORE_FOLDER)
+    inputs = [source, hf.REGIONS_FILE, hf.BS_POS_FILE]
+    key = {
+        "version": UNIT_VERSION,
+        "threshold": threshold,
+        "tolerance": tolerance,
+        "strand": strand,
+        "negatives": negatives,
+        # matched negatives are drawn from the unit's index afterwards, so the ratio doesn't change the unit
+        "ratio": ratio if negatives == "first" else None,
+        "pwm": hashlib.sha1(np.ascontiguousarray(logodds).tobytes()).hexdigest(),
+        "inputs": [[f, os.path.getmtime(f) if os.path.isfile(f) else None] for f in inputs],
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def runUnit(chromosome, logodds, threshold, tolerance, strand, negatives, ratio, unit_files, profile_file=None, trace_memory=False,
+            table_folders=None, encoded=None):
+    """
+    Runs extractUnit(), streaming the samples of each TF into its unit files. The files are only moved into
+    place once the unit is complete, so an interrupted run never leaves a partial unit behind.
+
+    Args:
+        unit_files (dict): Mapping of TF name -> (positive, negative) filepaths of its unit files for this chromosome
+        profile_file (str): If given, the unit is run under cProfile and the stats saved to this file
+        trace_memory (bool): Whether to also record the peak Python allocations of each stage
+        table_folders (dict): Mapping of TF name -> (positive, negative) folders of its sample tables for this
+                              chromosome (negative is None with 'matched' negatives). If None, no tables are written.
+        encoded (np.array): The encoded chromosome, if already loaded
+        (other arguments as for extractUnit())
+
+    Returns:
+        log (list): Lines of logging output for the unit
+        records (list): Metrics of the unit's stages (see instrumentation.Metrics)
+    """
+    metrics = ins.Metrics(trace_memory=trace_memory, chromosome=chromosome, tfs=list(logodds))
+    part_files = {TF: tuple(open(path + ".tmp", "wb") for path in paths) for TF, paths in unit_files.items()}
+    tables = None
+    if table_folders is not None:
+        tables = {TF: tuple(None if folder is None else st.TableWriter(folder + ".tmp", TF, chromosome, logodds[TF].shape[0])
+                            for folder in folders) for TF, folders in table_folders.items()}
+    try:
+        with ins.profiled(profile_file):
+            log = extractUnit(chromosome, logodds, part_files, threshold, tolerance, metrics, strand, negatives, ratio, tables, encoded)
+    finally:
+        for files in list(part_files.values()) + list((tables or {}).values()):
+            for f in files:
+                if f is not None:
+                    f.close()
+    for paths in unit_files.values():
+        for path in paths:
+            os.replace(path + ".tmp", path)
+    for folders in (table_folders or {}).values():
+        for folder in folders:
+            if folder is not None:
+                st.replaceTable(folder + ".tmp", folder)
+    return log, metrics.records
+
+def copyUnitSamples(unit_file, writer, batch_bytes=2**20):
+    """
+    Streams the sequences of a unit file (one per line) into a SampleWriter in batches.
+    """
+    with open(unit_file, "rb") as f:
+        while True:
+            lines = f.readlines(batch_bytes)
+            if not lines:
+                break
+            writer.writeBatch([line.rstrip(b"\n") for line in lines])
+
+def computeUnitShapes(unit_files, shapes_path, table_file, batch_bytes=2**20, cache=None):
+    """
+    Computes the DNA shape features (MGW, Roll, ProT, HelT) of the samples in a TF's unit files, in the same order
+    as its FASTA file, and saves them to a .npz file (see shapeFeatures.saveShapes()).
+    With a sequenceCache.SequenceCache, repeated sequences (within and across TFs) are only computed once.
+    """
+    batches = []
+    for unit_file in unit_files:
+        with open(unit_file, "rb") as f:
+            while True:
+                lines = f.readlines(batch_bytes)
+                if not lines:
+                    break
+                batches.append(sf.cachedShapes([line.rstrip(b"\n") for line in lines], table_file, cache))
+    shapes = {name: np.concatenate([b[name] for b in batches]) if batches else np.empty((0, 0), dtype=np.float32)
+              for name in sf.SHAPES}
+    sf.saveShapes(shapes_path, shapes)
+    return shapes
+
+def loadManifest(manifest_path):
+    """
+    Loads the checkpoint manifest of an output folder (unit name -> key of the unit when it was completed).
+    """
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {}
+
+def saveManifest(manifest, manifest_path):
+    """
+    Saves the checkpoint manifest, replacing the old one atomically.
+    """
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def parseArgs(argv=None):
+    """
+    Parses the command line arguments. Defaults are the constants at the top of this file.
+    """
+    parser = argparse.ArgumentParser(description="Extract positive and negative TFBS samples from PWM hits on active regions.")
+    parser.add_argument("--tfs", nargs="+", default=tfs, help="transcription factors to extract samples for")
+    parser.add_argument("--chromosomes", nargs="+", default=CHRS, help="chromosomes to search on")
+    parser.add_argument("--threshold", type=float, default=PWM_THRESH, help="threshold for the PWM search")
+    parser.add_argument("--tolerance", type=int, default=MATCH_TOLERANCE,
+                        help="max distance (bp) between a PWM hit and a bound site start for a positive sample")
+    parser.add_argument("--strand", choices=["+", "both"], default=STRAND,
+                        help="look for motifs on the positive strand only, or on both strands in one pass")
+    parser.add_argument("--negatives", choices=["first", "matched"], default=NEGATIVES,
+                        help="take the first unbound hits as negatives, or a seeded GC- and score-matched sample of them")
+    parser.add_argument("--neg-ratio", type=float, default=NEG_RATIO, help="number of negative samples per positive sample")
+    parser.add_argument("--seed", type=int, default=SEED, help="seed of the matched negative sampling")
+    parser.add_argument("--out-dir", default=None,
+                        help="output folder; rerunning with the same folder resumes the run (default: new timestamped folder in outputs/)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="number of worker processes")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH,
+                        help="number of chromosomes loaded ahead on a background thread (0 disables)")
+    parser.add_argument("--compress", action="store_true", default=COMPRESS_OUTPUT, help="gzip the output FASTA files")
+    parser.add_argument("--columnar", action="store_true", default=COLUMNAR_OUTPUT,
+                        help="also save the samples of each (TF, chromosome) as a columnar table (see sampleTable.py)")
+    parser.add_argument("--shape-table", default=None,
+                        help="pentamer shape table; if given, DNA shape features of the samples are also saved (.npz)")
+    parser.add_argument("--profile", action="store_true", default=PROFILE,
+                        help="run each unit under cProfile, saving the stats in the profiles/ subfolder")
+    parser.add_argument("--trace-memory", action="store_true", default=TRACE_MEMORY,
+                        help="also record peak Python allocations (tracemalloc) of each stage")
+    parser.add_argument("--force", action="store_true", help="recompute every unit, even ones already completed")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parseArgs(argv)
 
     # logging
     now = hf.getTime()
     print(f"Started at {now.strftime(f'%H:%M')} on {now.strftime(f'%Y-%m-%d')}")
 
     # create subfolder for outputs
-    # (outputs will be FASTA files containing positive & negative samples)
-    OUT_SUBFOLDER = OUT_FOLDER + now.strftime(f"%Y-%m-%d_%H%M_FASTA_files/")
-    if not os.path.exists(OUT_SUBFOLDER):
-        os.mkdir(OUT_SUBFOLDER)
-
-    # tracking time
-    total_start = time.time()
-
-    # loop through chosen transcription factors and extract samples
-    for TF in tfs:
-        # time tracking
-        subtotal_start = time.time()
-
-        # setting up text files to hold extracted samples
-        now = hf.getTime()
-        pos_path = OUT_SUBFOLDER + now.strftime(f"%Y-%m-%d_%H%M_{TF}_positive.txt")
-        neg_path = OUT_SUBFOLDER + now.strftime(f"%Y-%m-%d_%H%M_{TF}_negative.txt")
-        pos_tf = hf.TextWriter(pos_path)
-        neg_tf = hf.TextWriter(neg_path)
-
-        # logging
-        print("-------------------------------------------------")
-        print(f"TF: {TF}\n")
-
-        # load the PWN for the current TF from jaspar file
-        jaspar_file = DATA_FOLDER + f"/jaspars/{TF}_jaspar.pfm"
-        with open(jaspar_file) as handle:
-            motif = motifs.read(handle, 'jaspar')
-
-        # variables to track number of samples extracted
-        total_pos, total_neg = 0, 0
-
-        # variables to track labels in the output FASTA file
-        pos_label, neg_label = 1, 1
-
-        # search on every chromosome in list
-        for chromosome in CHRS:
-            # time tracking
-            chr_start = time.time()
-
-            # get DNA sequence from chromosome FASTA file
-            seq_file = CHR_FOLDER + f"{chromosome}.fa"
-            sequence = list(SeqIO.parse(seq_file, "fasta"))[0].seq
-
-            # get active regions for chromosome
-            active_regions = hf.getActiveRegions(chromosome)
-
-            # logging
-            print(f"{chromosome}: {len(sequence):,} nucleotides ------------------------")
-            print(f"Searching for potential {TF} binding sites on {chromosome} active regions...")
-
-            # use PWM to search for potential binding sites on active regions
-            positions = []
-            scores = []
-            t_start = time.time()
-            for region in active_regions:
-                for pos, score in motif.pssm.search(sequence[region[0]:region[1]-len(motif)], threshold=PWM_THRESH):
-                    # only consider motifs found on the positive strand
-                    if (pos > 0):
-                        positions.append(region[0]+pos)
-                        scores.append(score)
-            t_end = time.time()
-
-            # logging
-            print(f"Done in {hf.stringTime(t_start, t_end)}\n")
-            print(f"{len(positions):,} potential TFBS's found on {chromosome} active regions")
-            if (len(positions) != 0):
-                print(f"Highest score: {max(scores):.3f} at position {positions[np.argmax(scores)]:,} giving sequence {sequence[positions[np.argmax(scores)]:positions[np.argmax(scores)]+len(motif)].upper()}\n")
-
-            # get locations of bound binding sites from factorbookMotifPos file
-            bs_locs = hf.getBindingSiteLocs(TF, chromosome)
-            bs_start_pos = [x[0] for x in bs_locs]
-            print(f"{len(bs_locs):,} bound {TF} TFBS's on {chromosome} found in factorbookMotifPos\n")
-
-            # extracting positive samples
-            # (cases where a potential binding site from above is found in the factorbookMotifPos file)
-            print("Getting positive samples...")
-            t_start = time.time()
-            num_matches = 0 # counting positive samples to make sure we match with # of negative samples
-            match_starts = []
-            for pos in positions:
-                if (pos in bs_start_pos):
-                    num_matches += 1
-                    match_starts.append(pos)
-                    pos_tf.writeTxt(f">{pos_label}", print_console=False)
-                    pos_tf.writeTxt(str(sequence[pos:pos+len(motif)].upper()), print_console=False)
-                    pos_label += 1
-            t_end = time.time()
-            print(f"Extracted {len(match_starts)} positive samples in {hf.stringTime(t_start, t_end)}\n")
-            total_pos += len(match_starts)
-
-            # extracting negative samples
-            # (cases where a potential binding site from above is NOT found in the factorbookMotifPos file)
-            print("Getting negative samples...")
-            t_start = time.time()
-            j = 0
-            mismatch_starts = []
-            for pos in positions:
-                if (j == num_matches):
-                    break # for equal number of negative + positive samples
-                if (pos not in bs_start_pos):
-                    mismatch_starts.append(pos)
-                    neg_tf.writeTxt(f">{neg_label}", print_console=False)
-                    neg_tf.writeTxt(str(sequence[pos:pos+len(motif)].upper()), print_console=False)
-                    neg_label += 1
-                    j += 1
-            t_end = time.time()
-            print(f"Extracted {len(mismatch_starts)} negative samples in {hf.stringTime(t_start, t_end)}\n")
-            total_neg += len(mismatch_starts)
-
-            # logging time for current chromosome
-            chr_end = time.time()
-            print(f"Total time for {chromosome}: {hf.stringTime(chr_start, chr_end)}\n")
-
-        # logging time for current Tf
-        subtotal_end = time.time()
-        print("##########################")
-        print(f"Total time for {TF}: {hf.stringTime(subtotal_start, subtotal_end)}\n")
-        print(f"Number of {TF} positive samples: {total_pos:,}")
-        print(f"Number of {TF} negative samples: {total_neg:,}\n")
+    # (outputs will be FASTA files containing positive & negative samples, plus per-unit checkpoints)
+    out_folder = args.out_dir or OUT_FOLDER + now.strftime(f"%Y-%m-%d_%H%M_FASTA_files/")
+    units_folder = os.path.join(out_folder, "units")
+    os.makedirs(units_folder, exist_ok=True)
+    # timestamped folders keep the old naming of their FASTA files
+    folder_name = os.path.basename(os.path.normpath(out_folder))
+    prefix = folder_name[:-len("FASTA_files")] if folder_name.endswith("FASTA_files") else ""
+
+    # stage metrics of this run (one JSON line per stage) and, if asked for, cProfile stats of each unit
+    run_id = now.strftime("%Y-%m-%d_%H%M%S")
+    metrics_path = os.path.join(out_folder, ins.METRICS_FILE.format(run=run_id))
+    profiles_folder = os.path.join(out_folder, "profiles")
+    metrics = ins.Metrics(trace_memory=args.trace_memory)
+
+    with metrics.stage("run", tfs=args.tfs, chromosomes=args.chromosomes) as run:
+        # get the log-odds matrices of the chosen TFs straight from the factorbook motif library
+        library = ml.getLibrary()
+        logodds = {TF: library.logOdds(TF) for TF in args.tfs}
+
+        # one checkpoint per (TF, chromosome) pair, skipping those already completed with the same key
+        manifest_path = os.path.join(out_folder, "manifest.json")
+        manifest = loadManifest(manifest_path)
+        unit_files, sample_files, table_folders, pending = {}, {}, {}, {}
+        for TF in args.tfs:
+            for chromosome in args.chromosomes:
+                name = f"{TF}_{chromosome}"
+                key = unitKey(TF, chromosome, logodds[TF], args.threshold, args.tolerance, args.strand, args.negatives, args.neg_ratio)
+                sample_files[TF, chromosome] = tuple(os.path.join(units_folder, f"{name}_{label}.txt") for label in ("positive", "negative"))
+                # with matched negatives the unit saves its candidate index, the negatives are drawn from it below
+                unit_files[TF, chromosome] = sample_files[TF, chromosome] if args.negatives == "first" else \
+                    (sample_files[TF, chromosome][0], os.path.join(units_folder, f"{name}_candidates.npz"))
+                done = all(os.path.isfile(path) for path in unit_files[TF, chromosome])
+                if args.columnar:
+                    # with matched negatives the negative table is written when they are drawn
+                    table_folders[TF, chromosome] = tuple(os.path.join(units_folder, f"{name}_{label}_table")
+                                                          for label in ("positive", "negative"))
+                    if (args.negatives == "matched"):
+                        table_folders[TF, chromosome] = (table_folders[TF, chromosome][0], None)
+                    done = done and all(os.path.isdir(folder) for folder in table_folders[TF, chromosome] if folder is not None)
+                if (args.force or manifest.get(name) != key or not done):
+                    pending.setdefault(chromosome, []).append((TF, name, key))
+        n_pending = sum(len(v) for v in pending.values())
+        print(f"{len(unit_files) - n_pending} of {len(unit_files)} (TF, chromosome) units already done, {n_pending} to run\n")
+
+        # pending TFs on the same chromosome are scanned together in one pass; when there are fewer chromosomes
+        # than workers, each chromosome's TFs are split into a few groups so every worker has something to do
+        work = []
+        for chromosome, todo in pending.items():
+            n_groups = min(len(todo), max(1, -(-args.workers // len(pending))))
+            for group in np.array_split(np.arange(len(todo)), n_groups):
+                group = [todo[i] for i in group]
+                profile_file = None
+                if args.profile:
+                    profile_file = os.path.join(profiles_folder, f"{run_id}_{chromosome}_{'_'.join(TF for TF, _, _ in group)}.prof")
+                unit = (chromosome, {TF: logodds[TF] for TF, _, _ in group}, args.threshold, args.tolerance, args.strand,
+                        args.negatives, args.neg_ratio, {TF: unit_files[TF, chromosome] for TF, _, _ in group},
+                        profile_file, args.trace_memory,
+                        {TF: table_folders[TF, chromosome] for TF, _, _ in group} if args.columnar else None)
+                work.append(({name: key for _, name, key in group}, unit))
+
+        # run the pending units, recording their TFs in the manifest as soon as they are done
+        def recordDone(keys, result):
+            log, records = result
+            print("\n".join(log))
+            ins.writeRecords(records, metrics_path, run=run_id)
+            manifest.update(keys)
+            saveManifest(manifest, manifest_path)
+
+        if (args.workers > 1 and len(work) > 1):
+            with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                futures = {executor.submit(runUnit, *unit): keys for keys, unit in work}
+                for future in as_completed(futures):
+                    recordDone(futures[future], future.result())
+        else:
+            # the next unit's chromosome is loaded on a background thread while the current one is scanned
+            loaded = gs.prefetchChromosomes([unit[0] for _, unit in work], CHR_FOLDER, STORE_FOLDER, args.prefetch)
+            for (keys, unit), (_, encoded) in zip(work, metrics.timedIter("prefetch_wait", loaded)):
+                recordDone(keys, runUnit(*unit, encoded=encoded))
+
+        # draw the matched negatives of every unit from its candidate index (seeded per unit, so the draw doesn't
+        # depend on which units were rerun)
+        if (args.negatives == "matched"):
+            with metrics.stage("draw_negatives") as stage:
+                for chromosome, encoded in gs.prefetchChromosomes(args.chromosomes, CHR_FOLDER, STORE_FOLDER, args.prefetch):
+                    for TF in args.tfs:
+                        seed = [args.seed, zlib.crc32(f"{TF}_{chromosome}".encode())]
+                        motif_len = logodds[TF].shape[0]
+                        if not args.columnar:
+                            stage.add(drawNegatives(unit_files[TF, chromosome][1], encoded, motif_len,
+                                                    sample_files[TF, chromosome][1], args.neg_ratio, seed))
+                            continue
+                        neg_table = os.path.join(units_folder, f"{TF}_{chromosome}_negative_table")
+                        with st.TableWriter(neg_table + ".tmp", TF, chromosome, motif_len) as table:
+                            stage.add(drawNegatives(unit_files[TF, chromosome][1], encoded, motif_len,
+                                                    sample_files[TF, chromosome][1], args.neg_ratio, seed, table, logodds[TF]))
+                        st.replaceTable(neg_table + ".tmp", neg_table)
+                        table_folders[TF, chromosome] = (table_folders[TF, chromosome][0], neg_table)
+
+        # shapes are memoized by sequence across all the TFs of the run
+        shape_cache = sc.SequenceCache() if args.shape_table else None
+
+        # write out the samples of each TF from its unit files, in chromosome order,
+        # so labels and output files are the same however the units were run
+        for TF in args.tfs:
+            ext = ".txt.gz" if args.compress else ".txt"
+            pos_path = os.path.join(out_folder, f"{prefix}{TF}_positive{ext}")
+            neg_path = os.path.join(out_folder, f"{prefix}{TF}_negative{ext}")
+
+            with metrics.stage("assemble", tfs=[TF]) as stage, \
+                 hf.SampleWriter(pos_path) as pos_writer, hf.SampleWriter(neg_path) as neg_writer:
+                for chromosome in args.chromosomes:
+                    pos_file, neg_file = sample_files[TF, chromosome]
+                    copyUnitSamples(pos_file, pos_writer)
+                    copyUnitSamples(neg_file, neg_writer)
+                stage.add(pos_writer.count + neg_writer.count)
+
+            # columnar tables of the samples on each chromosome, positives then negatives like the FASTA files
+            if args.columnar:
+                with metrics.stage("columnar", tfs=[TF]) as stage:
+                    for chromosome in args.chromosomes:
+                        stage.add(st.mergeTables(table_folders[TF, chromosome],
+                                                 os.path.join(out_folder, f"{prefix}{TF}_{chromosome}_samples")))
+
+            # DNA shape features, computed straight from the extracted sequences
+            if args.shape_table:
+                for label in ("positive", "negative"):
+                    shapes_path = os.path.join(out_folder, f"{prefix}{TF}_{label}_shapes.npz")
+                    with metrics.stage("shapes", tfs=[TF], label=label) as stage:
+                        shapes = computeUnitShapes([sample_files[TF, chromosome][label == "negative"] for chromosome in args.chromosomes],
+                                                   shapes_path, args.shape_table, cache=shape_cache)
+                        stage.add(len(shapes["MGW"]))
+
+            # logging totals for current TF
+            print("##########################")
+            print(f"Number of {TF} positive samples: {pos_writer.count:,}")
+            print(f"Number of {TF} negative samples: {neg_writer.count:,}\n")
+
+    metrics.write(metrics_path, run=run_id)
+    if shape_cache is not None:
+        print(f"Shape cache: {shape_cache.summary()}")
 
     # logging total time
-    total_end = time.time()
     print("\n----------------------------------------------------")
-    print(f"Total time elapsed: {hf.stringTime(total_start, total_end)}\n")
-
-
-
-
+    print(f"Total time elapsed: {hf.stringTime(0, run.wall)}")
+    print(f"Stage metrics saved to {metrics_path}\n")
 
+if (__name__=="__main__"):
+    main()
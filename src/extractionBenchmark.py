@@ -0,0 +1,273 @@
+import os
+import io
+import time
+import json
+import argparse
+import platform
+import subprocess
+import contextlib
+import numpy as np
+import helperFunctions as hf
+import intervalIndex as ii
+import pwmScanner as ps
+import genomeStore as gs
+import motifLibrary as ml
+import extractSamples as es
+
+# CONSTANTS
+
+# folder locations
+curr = os.path.dirname(__file__)
+OUT_FOLDER = os.path.join(curr, "../outputs/")
+BENCH_FOLDER = OUT_FOLDER + "benchmarks/"
+
+# fixture sizes: chromosome length (bp), number of active regions, number of TFs, bound sites per TF
+SCALES = {
+    "small": {"length": 2*10**6, "regions": 2000, "tfs": 2, "sites": 500},
+    "medium": {"length": 2*10**7, "regions": 20000, "tfs": 4, "sites": 5000},
+    "large": {"length": 10**8, "regions": 100000, "tfs": 8, "sites": 25000},
+}
+
+# name of the synthetic chromosome
+CHROM = "chrSynth"
+
+# number of times each benchmark is repeated (the fastest run is reported)
+REPEATS = 3
+
+# seed of the fixture generator, so every run benchmarks the same data
+SEED = 0
+
+
+def makeFixtures(folder, scale="small", seed=SEED):
+    """
+    Generates a synthetic chromosome (FASTA file and genome store), a BED file of active regions and
+    factorbook-style PWM and motif position files in a folder. Every TF's motif is planted at its bound
+    sites (and as many decoy sites) inside the active regions, so the scan finds hits of both kinds.
+
+    Args:
+        folder (str): Folder to write the fixtures to
+        scale (str): Key of SCALES
+        seed (int): Seed of the random generator
+
+    Returns:
+        fixtures (dict): Filepaths of the fixtures and their sizes
+    """
+    size = SCALES[scale]
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    fa_folder = os.path.join(folder, "hg19/")
+    store_folder = os.path.join(folder, "hg19_store/")
+    os.makedirs(fa_folder, exist_ok=True)
+
+    # random sequence with a few N runs
+    codes = rng.integers(0, 4, size["length"], dtype=np.uint8)
+    for start in rng.integers(0, size["length"] - 1000, 10):
+        codes[start:start+rng.integers(10, 1000)] = ps.N_CODE
+
+    # non-overlapping active regions spread along the chromosome
+    spacing = size["length"] // size["regions"]
+    lens = rng.integers(100, 100 + spacing // 2, size["regions"])
+    gaps = rng.integers(0, spacing // 2, size["regions"])
+    starts = np.cumsum(gaps + np.r_[0, lens[:-1]])
+    keep = starts + lens < size["length"]
+    regions = np.column_stack((starts[keep], starts[keep] + lens[keep]))
+
+    # random PWMs, each motif planted at its bound sites and at as many unbound decoys
+    pwm_lines, pos_lines = [], []
+    for t in range(size["tfs"]):
+        TF = f"SYN{t}"
+        motif_len = int(rng.integers(10, 20))
+        pwm = rng.dirichlet(np.full(4, 0.3), motif_len).T
+        pwm_lines.append(f"{TF}\t{motif_len}\t" + "\t".join(",".join(f"{x:.6f}" for x in row) + "," for row in pwm))
+        consensus = pwm.argmax(axis=0).astype(np.uint8)
+
+        region_idx = rng.integers(0, len(regions), 2*size["sites"])
+        offsets = rng.integers(1, regions[region_idx, 1] - regions[region_idx, 0] - 2*motif_len)
+        sites = np.unique(regions[region_idx, 0] + offsets)
+        for site in sites:
+            codes[site:site+motif_len] = consensus
+        for b, site in enumerate(sites[::2]):
+            pos_lines.append(f"{b}\t{CHROM}\t{site}\t{site+motif_len}\t{TF}\t{rng.random()*10:.3f}\t+")
+
+    fa_file = os.path.join(fa_folder, f"{CHROM}.fa")
+    with open(fa_file, "wb") as f:
+        f.write(f">{CHROM}\n".encode())
+        text = ps.DECODE_TABLE[codes].tobytes()
+        f.write(b"\n".join(text[i:i+50] for i in range(0, len(text), 50)) + b"\n")
+    gs.convertFasta(fa_file, store_folder)
+
+    regions_file = os.path.join(folder, "regions.bed")
+    with open(regions_file, "w") as f:
+        f.writelines(f"{CHROM}\t{s}\t{e}\n" for s, e in regions)
+    pwm_file = os.path.join(folder, "factorbookMotifPwm.txt")
+    with open(pwm_file, "w") as f:
+        f.write("\n".join(pwm_lines) + "\n")
+    bs_pos_file = os.path.join(folder, "factorbookMotifPos.txt")
+    with open(bs_pos_file, "w") as f:
+        f.write("\n".join(pos_lines) + "\n")
+
+    return {"folder": folder, "fa_folder": fa_folder, "store_folder": store_folder, "regions_file": regions_file,
+            "pwm_file": pwm_file, "bs_pos_file": bs_pos_file, "length": int(size["length"]), "regions": len(regions),
+            "tfs": [f"SYN{t}" for t in range(size["tfs"])], "region_bp": int((regions[:, 1] - regions[:, 0]).sum())}
+
+@contextlib.contextmanager
+def usingFixtures(fixtures):
+    """
+    Context manager pointing the extraction pipeline's data files and folders at the fixtures.
+    """
+    saved = (hf.REGIONS_FILE, hf.BS_POS_FILE, es.CHR_FOLDER, es.STORE_FOLDER)
+    hf.REGIONS_FILE, hf.BS_POS_FILE = fixtures["regions_file"], fixtures["bs_pos_file"]
+    es.CHR_FOLDER, es.STORE_FOLDER = fixtures["fa_folder"], fixtures["store_folder"]
+    try:
+        yield
+    finally:
+        hf.REGIONS_FILE, hf.BS_POS_FILE, es.CHR_FOLDER, es.STORE_FOLDER = saved
+
+def timeIt(func, repeats=REPEATS, setup=None):
+    """
+    Times a function, returning the fastest of a few runs (seconds) and the result of the last one.
+    If given, setup() is called (untimed) before each run.
+    """
+    best, result = np.inf, None
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def _record(results, name, seconds, items=None, bp=None, samples=None):
+    entry = {"seconds": seconds}
+    if items is not None:
+        entry["items"] = int(items)
+        entry["items_per_sec"] = items / seconds
+    if bp is not None:
+        entry["bp"] = int(bp)
+        entry["bp_per_sec"] = bp / seconds
+    if samples is not None:
+        entry["samples"] = int(samples)
+        entry["samples_per_sec"] = samples / seconds
+    results[name] = entry
+    rates = [f"{entry[k]:,.0f} {k[:-len('_per_sec')]}/s" for k in ("bp_per_sec", "samples_per_sec", "items_per_sec") if k in entry]
+    print(f"{name:<28} {seconds*1000:10.2f} ms   {'   '.join(rates)}")
+
+def runBenchmarks(fixtures, repeats=REPEATS):
+    """
+    Times the extraction hot paths on a set of fixtures.
+
+    Returns:
+        results (dict): Mapping of benchmark name -> timing and throughput figures
+    """
+    results = {}
+    chrom, tfs = CHROM, fixtures["tfs"]
+    library = ml.MotifLibrary.fromText(fixtures["pwm_file"])
+    logodds = {TF: library.logOdds(TF) for TF in tfs}
+
+    # region lookup: first call parses the BED file, later ones use the per-process index
+    seconds, regions = timeIt(lambda: hf.getActiveRegions(chrom, regions_file=fixtures["regions_file"]), repeats,
+                              setup=ii._index_cache.clear)
+    _record(results, "getActiveRegions_cold", seconds, items=fixtures["regions"])
+    seconds, regions = timeIt(lambda: hf.getActiveRegions(chrom, regions_file=fixtures["regions_file"]), repeats)
+    _record(results, "getActiveRegions_warm", seconds, items=len(regions))
+
+    # binding site lookup, same split
+    bs_locs = lambda: [hf.getBindingSiteLocs(TF, chrom, bs_pos_file=fixtures["bs_pos_file"]) for TF in tfs]
+    seconds, locs = timeIt(bs_locs, repeats, setup=ii._index_cache.clear)
+    _record(results, "getBindingSiteLocs_cold", seconds, items=sum(len(l) for l in locs))
+    seconds, locs = timeIt(bs_locs, repeats)
+    _record(results, "getBindingSiteLocs_warm", seconds, items=sum(len(l) for l in locs))
+
+    # scan of the active regions for all TFs in one pass
+    encoded = np.asarray(gs.GenomeStore(fixtures["store_folder"]).encoded(chrom))
+    active_regions = np.asarray(regions, dtype=np.int64)
+    scan = lambda: [(TF, pos) for TF, pos, _, _ in es.scanStage(encoded, logodds, active_regions, es.PWM_THRESH, {})]
+    seconds, hits = timeIt(scan, repeats)
+    n_hits = sum(len(pos) for _, pos in hits)
+    _record(results, "scan", seconds, bp=fixtures["region_bp"]*len(tfs), items=n_hits)
+
+    # labelling of the hits
+    bound = {TF: l[:, 0] for TF, l in zip(tfs, locs)}
+    seconds, _ = timeIt(lambda: [hf.labelHits(pos, bound[TF]) for TF, pos in hits], repeats)
+    _record(results, "labelHits", seconds, items=n_hits)
+
+    # writing samples: line by line with TextWriter, in batches with SampleWriter
+    samples = [s.decode() for TF, pos in hits[:1] for s in ps.decodeWindows(encoded, pos, logodds[TF].shape[0])]
+    out_file = os.path.join(fixtures["folder"], "samples.fa")
+    def textWriter():
+        writer = hf.TextWriter(out_file)
+        for i, seq in enumerate(samples):
+            writer.writeTxt(f">{i+1}\n{seq}", print_console=False)
+    seconds, _ = timeIt(textWriter, repeats)
+    _record(results, "TextWriter", seconds, samples=len(samples))
+    def sampleWriter():
+        with hf.SampleWriter(out_file) as writer:
+            writer.writeBatch(samples)
+    seconds, _ = timeIt(sampleWriter, repeats)
+    _record(results, "SampleWriter", seconds, samples=len(samples))
+
+    # a whole extraction unit (load chromosome, scan, label, balance, write)
+    def extractUnit():
+        part_files = {TF: (io.BytesIO(), io.BytesIO()) for TF in tfs}
+        with usingFixtures(fixtures):
+            es.extractUnit(chrom, logodds, part_files)
+        return sum(f.getvalue().count(b"\n") for files in part_files.values() for f in files)
+    seconds, n_samples = timeIt(extractUnit, repeats)
+    _record(results, "extractUnit", seconds, bp=fixtures["region_bp"]*len(tfs), samples=n_samples)
+
+    return results
+
+def gitCommit():
+    """
+    Returns the current git commit of the repository, or None if it can't be found.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=curr, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parseArgs(argv=None):
+    """
+    Parses the command line arguments. Defaults are the constants at the top of this file.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the sample extraction hot paths on synthetic data.")
+    parser.add_argument("--scale", choices=list(SCALES), default="small", help="size of the synthetic fixtures")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="number of runs of each benchmark (fastest is kept)")
+    parser.add_argument("--seed", type=int, default=SEED, help="seed of the fixture generator")
+    parser.add_argument("--fixtures-dir", default=None,
+                        help="folder to generate the fixtures in (default: outputs/benchmarks/fixtures_<scale>)")
+    parser.add_argument("--out", default=None, help="JSON file to save the results to (default: timestamped file in outputs/benchmarks/)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parseArgs(argv)
+    now = hf.getTime()
+    commit = gitCommit()
+
+    fixtures_folder = args.fixtures_dir or BENCH_FOLDER + f"fixtures_{args.scale}/"
+    print(f"Generating {args.scale} fixtures in {fixtures_folder}...")
+    fixtures = makeFixtures(fixtures_folder, args.scale, args.seed)
+    print(f"{fixtures['length']:,} bp chromosome, {fixtures['regions']:,} active regions ({fixtures['region_bp']:,} bp), {len(fixtures['tfs'])} TFs\n")
+
+    results = runBenchmarks(fixtures, args.repeats)
+
+    out_file = args.out or BENCH_FOLDER + now.strftime(f"%Y-%m-%d_%H%M_{args.scale}_{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok=True)
+    report = {
+        "commit": commit,
+        "time": now.isoformat(),
+        "scale": args.scale,
+        "seed": args.seed,
+        "repeats": args.repeats,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "fixtures": {k: fixtures[k] for k in ("length", "regions", "region_bp", "tfs")},
+        "results": results,
+    }
+    with open(out_file, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"\nResults saved to {out_file}")
+
+if (__name__=="__main__"):
+    main()
@@ -0,0 +1,308 @@
+import os
+import glob
+import json
+import queue
+import threading
+import numpy as np
+import pwmScanner as ps
+
+# CONSTANTS
+
+# folder locations
+curr = os.path.dirname(__file__)
+DATA_FOLDER = os.path.join(curr, "../data/")
+CHR_FOLDER = DATA_FOLDER + "hg19/"
+STORE_FOLDER = DATA_FOLDER + "hg19_store/"
+
+# name of the index file inside a store folder
+INDEX_FILE = "index.json"
+
+# number of bytes of FASTA text encoded at a time during conversion
+CONVERT_CHUNK = 2**23
+
+# number of chromosomes prefetchChromosomes() loads ahead of the one in use (0 loads each one when it is needed)
+PREFETCH_DEPTH = 1
+
+
+def _writeRecord(name, chunks, out_folder):
+    """
+    Encodes one FASTA record, given as an iterator of raw sequence byte chunks, into '<name>.u8' (one uint8 code
+    per base) and '<name>.mask.npy' ((n, 2) array of [start, end) runs of lowercase/soft-masked bases).
+    Only one chunk is held in memory at a time.
+
+    Returns:
+        (dict): Index entry for the record
+    """
+    seq_file = f"{name}.u8"
+    mask_file = f"{name}.mask.npy"
+    length = 0
+    in_mask = False
+    mask_starts, mask_ends = [], []
+    with open(os.path.join(out_folder, seq_file), "wb") as f:
+        for chunk in chunks:
+            raw = np.frombuffer(chunk, dtype=np.uint8)
+            f.write(ps.ENCODE_TABLE[raw].tobytes())
+
+            # soft-masked runs, carrying the masked state over from the previous chunk
+            lower = raw >= ord("a")
+            edges = np.diff(np.concatenate(([in_mask], lower)).astype(np.int8))
+            mask_starts.append(np.flatnonzero(edges == 1) + length)
+            mask_ends.append(np.flatnonzero(edges == -1) + length)
+            if len(lower):
+                in_mask = bool(lower[-1])
+            length += len(raw)
+    if in_mask:
+        mask_ends.append(np.array([length]))
+
+    mask = np.column_stack((np.concatenate(mask_starts), np.concatenate(mask_ends))).astype(np.int64)
+    np.save(os.path.join(out_folder, mask_file), mask)
+    return {"length": length, "file": seq_file, "mask": mask_file}
+
+def _fastaRecords(fa_file):
+    """
+    Generator yielding (name, chunks) for each record of a FASTA file, where chunks is an iterator of
+    raw sequence bytes (line breaks removed) of about CONVERT_CHUNK bytes each.
+    """
+    with open(fa_file, "rb") as f:
+        line = f.readline()
+        while line:
+            if not line.startswith(b">"):
+                line = f.readline()
+                continue
+            name = line[1:].split()[0].decode()
+            state = {}
+
+            def chunks():
+                buf, size = [], 0
+                for seq_line in iter(f.readline, b""):
+                    if seq_line.startswith(b">"):
+                        state["next"] = seq_line
+                        break
+                    buf.append(seq_line.rstrip())
+                    size += len(buf[-1])
+                    if size >= CONVERT_CHUNK:
+                        yield b"".join(buf)
+                        buf, size = [], 0
+                yield b"".join(buf)
+
+            yield name, chunks()
+            line = state.get("next", b"")
+
+def convertFasta(fa_file, out_folder=STORE_FOLDER):
+    """
+    Converts a (multi-record) FASTA file into the genome store format: one uint8 code file per record, a soft-mask
+    side table and an entry in the store's index.json. Existing index entries for other records are kept,
+    so a whole genome can be converted one chromosome file at a time.
+
+    Args:
+        fa_file (str): Filepath of the FASTA file to convert
+        out_folder (str): Folder of the genome store (created if it doesn't exist)
+
+    Returns:
+        (list): Names of the records converted
+    """
+    os.makedirs(out_folder, exist_ok=True)
+    index_path = os.path.join(out_folder, INDEX_FILE)
+    index = {}
+    if os.path.isfile(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    names = []
+    for name, chunks in _fastaRecords(fa_file):
+        index[name] = _writeRecord(name, chunks, out_folder)
+        names.append(name)
+
+    with open(index_path, "w") as f:
+        json.dump(index, f, indent=1)
+    return names
+
+def convertGenome(fa_folder=CHR_FOLDER, out_folder=STORE_FOLDER):
+    """
+    Converts every .fa file in a folder (e.g. data/hg19/) into a genome store.
+    """
+    for fa_file in sorted(glob.glob(os.path.join(fa_folder, "*.fa"))):
+        print(f"Converting {os.path.basename(fa_file)}...")
+        convertFasta(fa_file, out_folder)
+
+
+class GenomeStore:
+    """
+    Class that gives random access to a genome converted with convertFasta()/convertGenome().
+    Sequences are memory-mapped, so opening the store is instant and only the pages actually sliced are read from disk.
+    Constructor takes the folder of the store.
+    """
+    def __init__(self, folder=STORE_FOLDER):
+        self.folder = folder
+        with open(os.path.join(folder, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self._maps = {}
+
+
+    def __contains__(self, chrom):
+        return chrom in self.index
+
+
+    def chromosomes(self):
+        return list(self.index)
+
+
+    def length(self, chrom):
+        return self.index[chrom]["length"]
+
+
+    def encoded(self, chrom):
+        """
+        Returns the whole chromosome as a read-only memory-mapped uint8 array of nucleotide codes
+        (same encoding as pwmScanner.encodeSequence()).
+        """
+        if chrom not in self._maps:
+            path = os.path.join(self.folder, self.index[chrom]["file"])
+            if self.length(chrom) == 0:
+                self._maps[chrom] = np.empty(0, dtype=np.uint8)
+            else:
+                self._maps[chrom] = np.memmap(path, dtype=np.uint8, mode="r", shape=(self.length(chrom),))
+        return self._maps[chrom]
+
+
+    def fetch(self, chrom, start, end):
+        """
+        Returns the encoded [start, end) slice of a chromosome (a zero-copy view of the memory map).
+        """
+        return self.encoded(chrom)[start:end]
+
+
+    def fetchSequence(self, chrom, start, end, soft_mask=False):
+        """
+        Returns the [start, end) slice of a chromosome as a string. Uppercase unless soft_mask is True,
+        in which case soft-masked bases are lowercase as in the original FASTA file.
+        Ambiguous bases other than N are returned as N.
+        """
+        seq = ps.DECODE_TABLE[self.fetch(chrom, start, end)]
+        if soft_mask:
+            mask = self.softMask(chrom)
+            mask = mask[(mask[:, 1] > start) & (mask[:, 0] < end)]
+            for m_start, m_end in np.clip(mask - start, 0, end - start):
+                seq[m_start:m_end] += ord("a") - ord("A")
+        return seq.tobytes().decode()
+
+
+    def softMask(self, chrom):
+        """
+        Returns the soft-masked (lowercase) runs of a chromosome as an (n, 2) array of [start, end).
+        """
+        return np.load(os.path.join(self.folder, self.index[chrom]["mask"]))
+
+
+def chromosomeSource(chrom, fa_folder=CHR_FOLDER, store_folder=STORE_FOLDER):
+    """
+    Returns the filepath loadChromosome() will read a chromosome from: its file in the genome store if it has
+    been converted, otherwise its FASTA file.
+    """
+    index_path = os.path.join(store_folder, INDEX_FILE)
+    if os.path.isfile(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if chrom in index:
+            return os.path.join(store_folder, index[chrom]["file"])
+    return os.path.join(fa_folder, f"{chrom}.fa")
+
+def loadChromosome(chrom, fa_folder=CHR_FOLDER, store_folder=STORE_FOLDER):
+    """
+    Returns a chromosome as a uint8 array of nucleotide codes. Memory-maps it from the genome store if it has
+    been converted, otherwise falls back to parsing its FASTA file (slow, whole chromosome in memory).
+
+    Args:
+        chrom (str): Name of the chromosome, e.g. 'chr21'
+        fa_folder (str): Folder containing the <chrom>.fa files
+        store_folder (str): Folder of the genome store
+
+    Returns:
+        (np.array): The encoded chromosome
+    """
+    if os.path.isfile(os.path.join(store_folder, INDEX_FILE)):
+        store = GenomeStore(store_folder)
+        if chrom in store:
+            return store.encoded(chrom)
+
+    chunks = [b"".join(chunks) for name, chunks in _fastaRecords(os.path.join(fa_folder, f"{chrom}.fa"))]
+    return ps.ENCODE_TABLE[np.frombuffer(chunks[0], dtype=np.uint8)]
+
+def _loadAhead(chrom, fa_folder, store_folder):
+    """
+    Loads a chromosome for prefetchChromosomes(). A memory-mapped chromosome is also read through once, so its
+    pages are in the page cache by the time it is scanned.
+    """
+    encoded = loadChromosome(chrom, fa_folder, store_folder)
+    if isinstance(encoded, np.memmap):
+        buf = bytearray(CONVERT_CHUNK)
+        with open(chromosomeSource(chrom, fa_folder, store_folder), "rb", buffering=0) as f:
+            while f.readinto(buf):
+                pass
+    return encoded
+
+def prefetchChromosomes(chroms, fa_folder=CHR_FOLDER, store_folder=STORE_FOLDER, depth=PREFETCH_DEPTH):
+    """
+    Generator yielding (chrom, encoded) for a list of chromosomes, in order, loading the next ones on a background
+    thread while the caller works on the current one, so reading (and for FASTA files, parsing) overlaps with
+    scanning. The queue of loaded chromosomes is bounded: at most depth of them wait in it, plus one being loaded.
+    Consecutive repeats of a chromosome are only loaded once.
+
+    Args:
+        chroms (list): Names of the chromosomes, in the order they are needed
+        fa_folder (str): Folder containing the <chrom>.fa files
+        store_folder (str): Folder of the genome store
+        depth (int): Number of chromosomes loaded ahead. 0 loads each one in the calling thread when it is needed.
+
+    Yields:
+        chrom (str): Name of the chromosome
+        encoded (np.array): The encoded chromosome (as returned by loadChromosome())
+    """
+    if depth <= 0:
+        last = (None, None)
+        for chrom in chroms:
+            if chrom != last[0]:
+                last = (chrom, loadChromosome(chrom, fa_folder, store_folder))
+            yield last
+        return
+
+    loaded = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # give up if the consumer has gone away, instead of blocking forever on a full queue
+        while not stop.is_set():
+            try:
+                loaded.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def loader():
+        last = (None, None)
+        try:
+            for chrom in chroms:
+                if chrom != last[0]:
+                    last = (chrom, _loadAhead(chrom, fa_folder, store_folder))
+                if not put((last, None)):
+                    return
+        except BaseException as e:
+            put((None, e))
+
+    thread = threading.Thread(target=loader, name="chromosome-prefetch", daemon=True)
+    thread.start()
+    try:
+        for _ in chroms:
+            item, error = loaded.get()
+            if error is not None:
+                raise error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+if (__name__=="__main__"):
+    # one-time conversion of the hg19 FASTA files into the genome store
+    convertGenome()
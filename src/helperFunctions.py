@@ -1,9 +1,12 @@
 import math
 import datetime
+import gzip
 import pytz
 import os
 import re
 import numpy as np
+import intervalIndex as ii
+import motifLibrary as ml
 
 # CONSTANTS
 
@@ -11,6 +14,10 @@ import numpy as np
 curr = os.path.dirname(__file__)
 DATA_FOLDER = os.path.join(curr, "../data/")
 
+# data files used for sample extraction
+REGIONS_FILE = DATA_FOLDER + "wgEncodeRegTfbsClusteredV3.GM12878.merged.bed"
+BS_POS_FILE = DATA_FOLDER + "factorbookMotifPos-mini.txt"
+
 
 # ---------------- General helper functions ----------------
 
@@ -72,6 +79,52 @@ class TextWriter:
             txt_file.write(string + "\n")
             if(print_console): print(string)
 
+class SampleWriter:
+    """
+    Class that creates an object which writes samples to a FASTA-style file (">label" line followed by the
+    sequence line), keeping the file open and writing whole batches of records at once.
+    Constructor takes a filepath (including filename) to the desired file. Will overwrite file if it already exists.
+    Output is gzip compressed if compress is True (default: if the filepath ends in '.gz').
+    Labels are consecutive integers starting from first_label, continuing across batches.
+    Can be used as a context manager, otherwise close() must be called when done.
+    """
+    def __init__(self, filepath, first_label=1, compress=None, buffer_size=2**20):
+        self.filepath = filepath
+        self.next_label = first_label
+        self.count = 0
+        if compress is None:
+            compress = filepath.endswith(".gz")
+        if compress:
+            self.file = gzip.open(filepath, "wb", compresslevel=6)
+        else:
+            self.file = open(filepath, "wb", buffering=buffer_size)
+
+
+    def writeBatch(self, sequences):
+        """
+        Writes a batch of sequences (str or bytes) as consecutively labelled records.
+        """
+        records = []
+        for seq in sequences:
+            if isinstance(seq, str):
+                seq = seq.encode("ascii")
+            records.append(b">%d\n%s\n" % (self.next_label, seq))
+            self.next_label += 1
+        self.file.write(b"".join(records))
+        self.count += len(records)
+
+
+    def close(self):
+        self.file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
 def loadRaw(file):
     """
     Loads a raw text-like file into a list of its lines
@@ -97,31 +150,58 @@ def removeLineBreaks(raw):
 
 # ---------------- Sample extraction helper functions ----------------
 
-def getBindingSiteLocs(TF, chromosome='chr21'):
+def getBindingSiteLocs(TF, chromosome='chr21', strand='+', bs_pos_file=None):
     """
     Takes a specific transcription factor (TF) and name of a chromosome sequence and returns the binding site 
     locations associated with them. Locations taken from 'factorbookMotifPos.txt'.
-    Note: Currently only considers the positive strand
+    The file is parsed into an interval index once per process, so repeated calls are cheap.
     Args:
         TF (str): Name of the TF you want TFBS locations for. Must match the name in the file exactly.
         chromosome (str): Name of the chromosome you want to get locations for. Must match name in the file exactly. Default is 'chr21'.
+        strand (str): Strand to get locations for ('+' or '-'), or None for both. Default is '+'.
+        bs_pos_file (str): Filepath of the factorbookMotifPos file. Defaults to the one in the data folder.
 
     Returns:
-        bs_locs (list): List of TFBS locations as [start, end] arrays.
+        bs_locs (np.array): (n, 2) array of TFBS locations as [start, end] rows, sorted by start.
     """
-    bs_pos_file = DATA_FOLDER + 'factorbookMotifPos-mini.txt'
-    bs_pos_raw = loadRaw(bs_pos_file)
-    bs_locs = []
-    for line in bs_pos_raw:
-        if (TF in line and chromosome in line and '+' in line):
-            temp = line.split()
-            bs_locs.append((int(temp[2]), int(temp[3])))
+    if bs_pos_file is None:
+        bs_pos_file = BS_POS_FILE
+    index = ii.loadMotifPosIndex(bs_pos_file).get(TF)
+    if index is None:
+        return np.empty((0, 2), dtype=np.int64)
+    return index.intervals(chromosome, strand=strand)
+
+def labelHits(positions, bound_starts, tolerance=0):
+    """
+    Labels PWM hits as bound (positive) or unbound (negative) in a single vectorized pass, by looking up each
+    hit's start position in the sorted start positions of the known binding sites.
 
-    return bs_locs
+    Args:
+        positions (array-like): Start positions of the PWM hits
+        bound_starts (array-like): Start positions of the bound binding sites (e.g. from getBindingSiteLocs())
+        tolerance (int): Maximum distance (in bp) between a hit and a binding site start for the hit to count as bound.
+                         Default is 0, i.e. the start positions must match exactly.
+
+    Returns:
+        is_bound (np.array): Boolean array, True where the corresponding hit is a bound binding site
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    bound_starts = np.unique(np.asarray(bound_starts, dtype=np.int64))
+    if len(bound_starts) == 0:
+        return np.zeros(positions.shape, dtype=bool)
+    if tolerance == 0:
+        return np.isin(positions, bound_starts)
+
+    # distance to the nearest binding site start on either side
+    idx = np.searchsorted(bound_starts, positions)
+    right = bound_starts[np.minimum(idx, len(bound_starts) - 1)] - positions
+    left = positions - bound_starts[np.maximum(idx - 1, 0)]
+    return (np.abs(right) <= tolerance) | (np.abs(left) <= tolerance)
 
 def getPWM(TF):
     """
-    Takes a desired transcription factor (TF) and returns its corresponding PWM from the factorbookMotifPwm file
+    Takes a desired transcription factor (TF) and returns its corresponding PWM from the factorbookMotifPwm file.
+    The file is parsed once per process (and cached in binary form) by motifLibrary.
 
     Args:
         TF (str): The desired TF to extract a PWM for
@@ -129,26 +209,7 @@ def getPWM(TF):
     Returns:
         (np.array): The PWM for the given TF
     """
-    pwm_file = DATA_FOLDER + 'factorbookMotifPwm.txt'
-    pwm_raw = loadRaw(pwm_file)
-    for line in pwm_raw:
-        if (line.split()[0]==TF):
-            numbers = []
-            for t in line.split()[2:]:
-                numbers += t.split(',')
-
-    rows = [[]]
-    j = 0
-    for i in range(len(numbers)):
-        if (numbers[i] != ''):
-            rows[j].append(float(numbers[i]))
-        elif(i==len(numbers)-1):
-            continue
-        else:
-            rows.append([])
-            j += 1
-            
-    return np.asarray(rows)
+    return ml.getLibrary()[TF]
 
 def writePWMJaspar(TF):
     """
@@ -178,157 +239,32 @@ def writePWMJaspar(TF):
         for i in range(pwm.shape[0]):
             tf.writeTxt(f"{nts[i]} [ {' '.join([str(x) for x in pwm[i, :]])} ]", print_console=False)
 
-def getActiveRegions(chromosome='chr21'):
+def getActiveRegions(chromosome='chr21', merge=False, regions_file=None):
     """
     Takes a chromosome as a string and extracts its active regions from the list of active regions.
+    The file is parsed into an interval index once per process, so repeated calls are cheap.
 
     Args:
         chromosome (str): The name of the chromosome to get active regions for
+        merge (bool): Whether to merge overlapping active regions. Default is False.
+        regions_file (str): Filepath of the BED file of active regions. Defaults to the one in the data folder.
 
     Returns:
-        active_regions (list): List of start and end locations of the active regions for the given chromosome
+        active_regions (np.array): (n, 2) array of start and end locations of the active regions for the given chromosome
     """
-    regions_file = DATA_FOLDER + "wgEncodeRegTfbsClusteredV3.GM12878.merged.bed"
-    regions_raw = loadRaw(regions_file)
-
-    active_regions = []
-    for line in regions_raw:
-        if (chromosome in line):
-            temp = line.split()
-            active_regions.append([int(temp[1]), int(temp[2])])
-    
-    return active_regions
+    if regions_file is None:
+        regions_file = REGIONS_FILE
+    return ii.loadBedIndex(regions_file, merge=merge).intervals(chromosome)
 
 
 # ---------------- Data processing/model exploration helper functions ----------------
 
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import confusion_matrix
-import matplotlib.pyplot as plt
-import seaborn as sns
-
-def loadPhysicalProperty(file):
-    """
-    Loads a physical property text file downloadoed from DNAShape and puts it into a Pandas dataframe.
-
-    Args:
-        file (str): Filepath of the physical property text file to be loaded
-
-    Returns:
-        (pd.DataFrame): The physical properties loaded into a Pandas dataframe
-    """
-    raw = loadRaw(file)
-    raw = removeLineBreaks(raw)
-    properties = []
-    for r in raw:
-        if ('>' not in r):
-            properties.append(r.split(','))
+# these live in modelHelpers.py, so that importing this module for the extraction helpers above only needs NumPy
+# (pandas, scikit-learn, matplotlib and seaborn take seconds to import); they are loaded from there on first use
+MODEL_HELPERS = ['loadPhysicalPropertyArray', 'loadPhysicalProperty', 'getFeatsScaled', 'getFeatsAveraged', 'getFeatsScaledAndAveraged', 'plot_confusion_matrix']
 
-    return pd.DataFrame(properties).apply(pd.to_numeric, errors='coerce').dropna(axis=1)
-
-def getFeatsScaled(mgw_file, roll_file, pro_twist_file, hel_twist_file):
-    """
-    Takes filepaths for all 4 physical property files (mgw, roll, proT, helT) and concats them all into one big features matrix.
-    Concatenation is along axis=1. Values are all scaled with StandardScaler before concatenation.
-    Final output matrix size will be num_samples x (mgw.shape[1]+roll.shape[1]+pro_twist.shape[1]+hel_twist.shape[1])
-
-    Args:
-        mgw_file (str): Filepath to the mgw properties
-        roll_file (str): Filepath to the roll properties
-        pro_twist_file (str): Filepath to the pro_twist properties
-        hel_twist_file (str): Filepath to the hel_twist properties
-
-    Returns:
-        all_props (pd.DataFrame): All the scaled physical properties concatenated together along axis=1
-    """
-    mgw = loadPhysicalProperty(mgw_file)
-    roll = loadPhysicalProperty(roll_file)
-    pro_twist = loadPhysicalProperty(pro_twist_file)
-    hel_twist = loadPhysicalProperty(hel_twist_file)
-
-    scaler = StandardScaler()
-    mgw = pd.DataFrame(scaler.fit_transform(mgw.values))
-    roll = pd.DataFrame(scaler.fit_transform(roll.values))
-    pro_twist = pd.DataFrame(scaler.fit_transform(pro_twist.values))
-    hel_twist = pd.DataFrame(scaler.fit_transform(hel_twist.values))
-
-    all_props = pd.concat([mgw, roll, pro_twist, hel_twist], axis=1)
-
-    return all_props
-
-def getFeatsAveraged(mgw_file, roll_file, pro_twist_file, hel_twist_file):
-    """
-    Takes filepaths for all 4 physical property files (mgw, roll, proT, helT) and concats them all into one big features matrix.
-    Concatenation is along axis=1. Values in each row are averaged before concatenation.
-    Final output matrix size will be num_samples x 4
-
-    Args:
-        mgw_file (str): Filepath to the mgw properties
-        roll_file (str): Filepath to the roll properties
-        pro_twist_file (str): Filepath to the pro_twist properties
-        hel_twist_file (str): Filepath to the hel_twist properties
-
-    Returns:
-        all_props (pd.DataFrame): All the averaged physical properties concatenated together along axis=1
-    """
-    mgw = loadPhysicalProperty(mgw_file).mean(axis=1)
-    roll = loadPhysicalProperty(roll_file).mean(axis=1)
-    pro_twist = loadPhysicalProperty(pro_twist_file).mean(axis=1)
-    hel_twist = loadPhysicalProperty(hel_twist_file).mean(axis=1)
-
-    all_props = pd.concat([mgw, roll, pro_twist, hel_twist], axis=1)
-
-    return all_props
-
-def getFeatsScaledAndAveraged(mgw_file, roll_file, pro_twist_file, hel_twist_file):
-    """
-    Takes filepaths for all 4 physical property files (mgw, roll, proT, helT) and concats them all into one big features matrix.
-    Concatenation is along axis=1. Values in each row are scaled and then averaged before concatenation.
-    Final output matrix size will be num_samples x 4
-
-    Args:
-        mgw_file (str): Filepath to the mgw properties
-        roll_file (str): Filepath to the roll properties
-        pro_twist_file (str): Filepath to the pro_twist properties
-        hel_twist_file (str): Filepath to the hel_twist properties
-
-    Returns:
-        all_props (pd.DataFrame): All the averaged physical properties concatenated together along axis=1
-    """
-    mgw = loadPhysicalProperty(mgw_file)
-    roll = loadPhysicalProperty(roll_file)
-    pro_twist = loadPhysicalProperty(pro_twist_file)
-    hel_twist = loadPhysicalProperty(hel_twist_file)
-
-    scaler = StandardScaler()
-    mgw = pd.DataFrame(scaler.fit_transform(mgw.values))
-    roll = pd.DataFrame(scaler.fit_transform(roll.values))
-    pro_twist = pd.DataFrame(scaler.fit_transform(pro_twist.values))
-    hel_twist = pd.DataFrame(scaler.fit_transform(hel_twist.values))
-
-    mgw = mgw.mean(axis=1)
-    roll = roll.mean(axis=1)
-    pro_twist = pro_twist.mean(axis=1)
-    hel_twist = hel_twist.mean(axis=1)
-
-    all_props = pd.concat([mgw, roll, pro_twist, hel_twist], axis=1)
-
-    return all_props
-
-# adapted from https://stackoverflow.com/questions/19233771/sklearn-plot-confusion-matrix-with-labels
-def plot_confusion_matrix(y_test, y_pred):
-    # get confusion matrix from predictions
-    cm = confusion_matrix(y_test, y_pred)
-
-    # plot confusion matrix
-    ax = plt.subplot()
-    sns.heatmap(cm, annot=True, fmt='g', ax=ax, cmap='Greens')
-    
-    # labels, title and ticks
-    ax.set_xlabel('Predicted')
-    ax.set_ylabel('True')
-    ax.xaxis.set_ticklabels(['positive', 'negative'])
-    ax.yaxis.set_ticklabels(['positive', 'negative'])
-    ax.set_title('Confusion Matrix')
-    plt.show()
\ No newline at end of file
+def __getattr__(name):
+    if name in MODEL_HELPERS:
+        import modelHelpers
+        return getattr(modelHelpers, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
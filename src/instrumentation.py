@@ -0,0 +1,202 @@
+import os
+import time
+import json
+import cProfile
+import resource
+import tracemalloc
+import contextlib
+
+# CONSTANTS
+
+# name of the metrics file written in each output folder, one per run
+METRICS_FILE = "metrics_{run}.jsonl"
+
+# stages running in this process, innermost last, across every Metrics object
+# (so a unit run in-process nests under the run's stages, and they all share the peak RSS counter)
+_running = []
+
+
+def resetPeakRss():
+    """
+    Resets the peak resident memory of this process where the OS allows it (Linux), so the next
+    peakRss() reading covers only what runs in between.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peakRss():
+    """
+    Returns the peak resident memory (MB) of this process.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+class Stage:
+    """
+    Class holding the measurements of one pipeline stage: wall and CPU time (both including and excluding
+    the time spent in stages nested inside it), peak memory and the number of items it processed.
+    Created by Metrics.stage() and Metrics.timedIter().
+    """
+    def __init__(self, name, tags):
+        self.name = name
+        self.tags = tags
+        self.items = 0
+        self.wall = self.cpu = 0.0
+        self.self_wall = self.self_cpu = 0.0
+        self.peak_rss = 0.0
+        self.peak_traced = 0.0
+        self._start = self._resume = None
+
+
+    def add(self, n=1):
+        """
+        Adds to the number of items processed by the stage.
+        """
+        self.items += n
+
+
+    def record(self):
+        """
+        Returns the measurements as a dict, ready to be written as a JSON line.
+        """
+        record = {"stage": self.name, **self.tags,
+                  "wall_s": self.wall, "self_wall_s": self.self_wall,
+                  "cpu_s": self.cpu, "self_cpu_s": self.self_cpu,
+                  "items": self.items, "peak_rss_mb": self.peak_rss, "pid": os.getpid()}
+        if self.peak_traced:
+            record["peak_traced_mb"] = self.peak_traced
+        return record
+
+
+class Metrics:
+    """
+    Class that records the wall time, CPU time, peak RSS and item counts of pipeline stages.
+    Stages can be timed as blocks of code (stage()) or as generators (timedIter()); when stages are nested or
+    chained, each one also gets its 'self' time with the time of the stages running inside it taken out.
+    If trace_memory is True, the peak of Python allocations (tracemalloc) is recorded too, which is slower.
+    Constructor takes tags (e.g. chromosome=...) added to every record.
+    """
+    def __init__(self, trace_memory=False, **tags):
+        self.tags = tags
+        self.trace_memory = trace_memory
+        self.records = []
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+    def _push(self, stage, reset_rss):
+        wall, cpu = time.perf_counter(), time.process_time()
+        if _running:
+            parent = _running[-1]
+            parent.self_wall += wall - parent._resume[0]
+            parent.self_cpu += cpu - parent._resume[1]
+        # peaks reached so far belong to every running stage, before they are reset for the new one
+        self._notePeaks(reset_rss)
+        stage._start = stage._resume = (wall, cpu)
+        _running.append(stage)
+
+
+    def _pop(self, stage):
+        wall, cpu = time.perf_counter(), time.process_time()
+        stage.wall += wall - stage._start[0]
+        stage.cpu += cpu - stage._start[1]
+        stage.self_wall += wall - stage._resume[0]
+        stage.self_cpu += cpu - stage._resume[1]
+        self._notePeaks(reset_rss=False)
+        _running.remove(stage)
+        if _running:
+            _running[-1]._resume = (wall, cpu)
+
+
+    def _notePeaks(self, reset_rss):
+        rss = peakRss()
+        traced = tracemalloc.get_traced_memory()[1] / 2**20 if self.trace_memory else 0.0
+        for stage in _running:
+            stage.peak_rss = max(stage.peak_rss, rss)
+            stage.peak_traced = max(stage.peak_traced, traced)
+        if reset_rss:
+            resetPeakRss()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+
+    @contextlib.contextmanager
+    def stage(self, name, **tags):
+        """
+        Context manager timing a block of code as a stage. Yields the Stage, whose add() counts items.
+        """
+        stage = Stage(name, {**self.tags, **tags})
+        self._push(stage, reset_rss=True)
+        try:
+            yield stage
+        finally:
+            self._pop(stage)
+            self.records.append(stage.record())
+
+
+    def timedIter(self, name, iterable, count=None, **tags):
+        """
+        Generator passing the items of an iterable (e.g. a pipeline stage generator) through, timing only the
+        time spent producing them. count(item), if given, returns the number of items each one stands for.
+        Peak RSS isn't reset for every item, so for these stages it is an upper bound.
+        """
+        stage = Stage(name, {**self.tags, **tags})
+        iterator = iter(iterable)
+        try:
+            while True:
+                self._push(stage, reset_rss=False)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    self._pop(stage)
+                stage.add(count(item) if count is not None else 1)
+                yield item
+        finally:
+            self.records.append(stage.record())
+
+
+    def write(self, metrics_file, **tags):
+        """
+        Appends the records collected so far to a JSON-lines file (with extra tags such as the run id) and clears them.
+        """
+        writeRecords(self.records, metrics_file, **tags)
+        self.records = []
+
+
+@contextlib.contextmanager
+def profiled(profile_file=None):
+    """
+    Context manager running a block of code under cProfile and saving the stats to profile_file
+    (open with pstats or snakeviz). Does nothing if profile_file is None.
+    """
+    if profile_file is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(os.path.abspath(profile_file)), exist_ok=True)
+        profiler.dump_stats(profile_file)
+
+def writeRecords(records, metrics_file, **tags):
+    """
+    Appends records (e.g. Metrics.records sent back from a worker process) to a JSON-lines file.
+    """
+    with open(metrics_file, "a") as f:
+        for record in records:
+            f.write(json.dumps({**tags, **record}) + "\n")
@@ -0,0 +1,175 @@
+import os
+import numpy as np
+
+# CONSTANTS
+
+# strand symbols used in the factorbook files and the int8 values they are stored as
+STRANDS = {'+': 1, '-': -1, '.': 0}
+
+# indexes that have already been built in this process, keyed by (kind, filepath, mtime, options)
+_index_cache = {}
+
+
+class IntervalIndex:
+    """
+    Per-chromosome index of [start, end) intervals held as sorted NumPy arrays.
+    Supports vectorized overlap and containment queries with np.searchsorted, so a lookup costs
+    O(log n) per query rather than a rescan of the source file.
+
+    Constructor takes a dict mapping chromosome name -> (starts, ends) or (starts, ends, strands).
+    If merge is True, overlapping (or touching) intervals on each chromosome are merged together
+    and strand information is dropped.
+    """
+    def __init__(self, intervals, merge=False):
+        self.chroms = {}
+        for chrom, arrays in intervals.items():
+            starts = np.asarray(arrays[0], dtype=np.int64)
+            ends = np.asarray(arrays[1], dtype=np.int64)
+            strands = np.asarray(arrays[2], dtype=np.int8) if len(arrays) > 2 else np.zeros(len(starts), dtype=np.int8)
+
+            order = np.lexsort((ends, starts))
+            starts, ends, strands = starts[order], ends[order], strands[order]
+            if merge:
+                starts, ends = mergeIntervals(starts, ends)
+                strands = np.zeros(len(starts), dtype=np.int8)
+
+            # running max of the ends lets an interval set with nested/overlapping intervals be
+            # queried with a single binary search on the starts
+            max_ends = np.maximum.accumulate(ends) if len(ends) else ends
+            self.chroms[chrom] = (starts, ends, strands, max_ends)
+
+
+    def __contains__(self, chrom):
+        return chrom in self.chroms
+
+
+    def __len__(self):
+        return sum(len(v[0]) for v in self.chroms.values())
+
+
+    def intervals(self, chrom, strand=None):
+        """
+        Returns the intervals on a chromosome as an (n, 2) array of [start, end), sorted by start.
+        Optionally only those on the given strand ('+' or '-').
+        """
+        if chrom not in self.chroms:
+            return np.empty((0, 2), dtype=np.int64)
+        starts, ends, strands, _ = self.chroms[chrom]
+        locs = np.column_stack((starts, ends))
+        if strand is not None:
+            locs = locs[strands == STRANDS[strand]]
+        return locs
+
+
+    def overlaps(self, chrom, starts, ends):
+        """
+        Returns a boolean array saying whether each query [start, end) overlaps any interval on chrom.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if chrom not in self.chroms:
+            return np.zeros(starts.shape, dtype=bool)
+        i_starts, _, _, max_ends = self.chroms[chrom]
+
+        # only intervals starting before the query end can overlap it, and one of them does
+        # if the furthest-reaching of them ends after the query start
+        idx = np.searchsorted(i_starts, ends, side='left')
+        return (idx > 0) & (max_ends[np.maximum(idx - 1, 0)] > starts)
+
+
+    def contains(self, chrom, starts, ends=None):
+        """
+        Returns a boolean array saying whether each query lies fully inside an interval on chrom.
+        Queries are positions if ends is None, [start, end) ranges otherwise.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = starts + 1 if ends is None else np.asarray(ends, dtype=np.int64)
+        if chrom not in self.chroms:
+            return np.zeros(starts.shape, dtype=bool)
+        i_starts, _, _, max_ends = self.chroms[chrom]
+
+        idx = np.searchsorted(i_starts, starts, side='right')
+        return (idx > 0) & (max_ends[np.maximum(idx - 1, 0)] >= ends)
+
+
+def mergeIntervals(starts, ends):
+    """
+    Merges overlapping or touching intervals. Inputs must be sorted by start.
+
+    Args:
+        starts (np.array): Start positions, sorted
+        ends (np.array): End positions
+
+    Returns:
+        starts (np.array): Start positions of the merged intervals
+        ends (np.array): End positions of the merged intervals
+    """
+    if len(starts) == 0:
+        return starts, ends
+    max_ends = np.maximum.accumulate(ends)
+    # a new merged interval begins wherever a start lies past everything seen so far
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] > max_ends[:-1]
+    first = np.flatnonzero(new)
+    last = np.append(first[1:] - 1, len(starts) - 1)
+    return starts[first], max_ends[last]
+
+def _groupColumns(rows, key_cols, start_col, end_col, strand_col=None):
+    """
+    Groups split text rows into NumPy coordinate arrays keyed by the values in key_cols.
+    """
+    groups = {}
+    for row in rows:
+        key = tuple(row[c] for c in key_cols)
+        group = groups.setdefault(key, ([], [], []))
+        group[0].append(int(row[start_col]))
+        group[1].append(int(row[end_col]))
+        group[2].append(STRANDS.get(row[strand_col], 0) if strand_col is not None else 0)
+    return groups
+
+def _cached(key, build):
+    if key not in _index_cache:
+        _index_cache[key] = build()
+    return _index_cache[key]
+
+def loadBedIndex(file, merge=False):
+    """
+    Loads a BED file (chrom, start, end, ...) into an IntervalIndex. The file is only parsed once per
+    process; later calls with the same file and options return the cached index.
+
+    Args:
+        file (str): Filepath of the BED file
+        merge (bool): Whether to merge overlapping intervals
+
+    Returns:
+        (IntervalIndex): Index of the intervals in the file
+    """
+    def build():
+        with open(file) as f:
+            rows = [line.split() for line in f if line.strip() and not line.startswith(('#', 'track', 'browser'))]
+        groups = _groupColumns(rows, [0], 1, 2)
+        return IntervalIndex({k[0]: v[:2] for k, v in groups.items()}, merge=merge)
+
+    return _cached(('bed', os.path.abspath(file), os.path.getmtime(file), merge), build)
+
+def loadMotifPosIndex(file):
+    """
+    Loads a factorbookMotifPos file (bin, chrom, start, end, TF, score, strand) into one IntervalIndex
+    per TF, keeping strand information. The file is only parsed once per process.
+
+    Args:
+        file (str): Filepath of the factorbookMotifPos file
+
+    Returns:
+        (dict): Mapping of TF name -> IntervalIndex of its binding sites
+    """
+    def build():
+        with open(file) as f:
+            rows = [line.split() for line in f if line.strip()]
+        groups = _groupColumns(rows, [4, 1], 2, 3, strand_col=6)
+        by_tf = {}
+        for (tf, chrom), arrays in groups.items():
+            by_tf.setdefault(tf, {})[chrom] = arrays
+        return {tf: IntervalIndex(intervals) for tf, intervals in by_tf.items()}
+
+    return _cached(('motifpos', os.path.abspath(file), os.path.getmtime(file)), build)
@@ -0,0 +1,189 @@
+import os
+import time
+import json
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+import helperFunctions as hf
+import instrumentation as ins
+import modelExploration as me
+
+# CONSTANTS
+
+# folder locations
+curr = os.path.dirname(__file__)
+OUT_FOLDER = os.path.join(curr, "../outputs/")
+# fitted models are kept here, one file per (model, hyperparameters, dataset, fold)
+CACHE_FOLDER = OUT_FOLDER + "model_cache/"
+
+# number of cross-validation folds
+FOLDS = 5
+
+# number of parallel jobs (-1 uses every core)
+N_JOBS = -1
+
+# seed of the fold split, so the folds (and with them the cache keys) are the same on every run
+SEED = 0
+
+# bump this when the content of the cached files changes, so old ones are refit
+CACHE_VERSION = 1
+
+
+def datasetHash(X, y):
+    """
+    Returns a hash of the contents of a features matrix and its targets.
+    """
+    h = hashlib.sha1()
+    for array in (np.ascontiguousarray(X, dtype=np.float64), np.ascontiguousarray(y, dtype=np.float64)):
+        h.update(str(array.shape).encode())
+        h.update(array.tobytes())
+    return h.hexdigest()
+
+def modelKey(model, data_hash, fold, folds=FOLDS, seed=SEED):
+    """
+    Returns the cache key of a model fitted on one cross-validation fold: a hash of its class,
+    hyperparameters, the dataset and the fold split.
+    """
+    key = {
+        "version": CACHE_VERSION,
+        "model": type(model).__name__,
+        "params": {k: repr(v) for k, v in model.get_params().items()},
+        "data": data_hash,
+        "fold": [fold, folds, seed],
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def benchmarkFold(model, X, y, train_idx, test_idx, cache_path=None):
+    """
+    Fits (or loads from the cache) a model on one fold and evaluates it on the held out samples.
+
+    Args:
+        model (sklearn estimator): Unfitted model, cloned before fitting
+        X (np.array): Features matrix
+        y (np.array): Targets
+        train_idx (np.array): Indexes of the training samples
+        test_idx (np.array): Indexes of the test samples
+        cache_path (str): Filepath of the cached fitted model. If None, nothing is cached.
+
+    Returns:
+        result (dict): Fit time (s), peak resident memory of the worker during the fit (MB), predict throughput (samples/s),
+                       scores and whether the model came from the cache
+    """
+    cached = cache_path is not None and os.path.isfile(cache_path)
+    if cached:
+        # fit figures are the ones measured when the model was cached
+        entry = joblib.load(cache_path)
+        fitted = entry["model"]
+    else:
+        fitted = clone(model)
+        X_train, y_train = X[train_idx], y[train_idx]
+        ins.resetPeakRss()
+        fit_start = time.perf_counter()
+        fitted.fit(X_train, y_train)
+        fit_time = time.perf_counter() - fit_start
+        entry = {"model": fitted, "fit_time": fit_time, "peak_rss_mb": ins.peakRss()}
+        if cache_path is not None:
+            joblib.dump(entry, cache_path + ".tmp")
+            os.replace(cache_path + ".tmp", cache_path)
+
+    predict_start = time.perf_counter()
+    y_pred = fitted.predict(X[test_idx])
+    predict_time = time.perf_counter() - predict_start
+
+    y_test = y[test_idx]
+    return {
+        "fit_time": entry["fit_time"],
+        "peak_rss_mb": entry["peak_rss_mb"],
+        "predict_rate": len(test_idx) / max(predict_time, 1e-9),
+        "accuracy": accuracy_score(y_test, y_pred),
+        "f1": f1_score(y_test, y_pred, zero_division=0),
+        "precision": precision_score(y_test, y_pred, zero_division=0),
+        "recall": recall_score(y_test, y_pred, zero_division=0),
+        "cached": cached,
+    }
+
+def benchmarkModels(models, X, y, folds=FOLDS, n_jobs=N_JOBS, cache_folder=CACHE_FOLDER, seed=SEED):
+    """
+    Cross-validates every model on the same stratified folds, running the (model, fold) fits in parallel
+    worker processes. Fitted models are cached by model, hyperparameters, dataset and fold, so models that
+    haven't changed are only evaluated again, not refit.
+
+    Args:
+        models (list): Unfitted sklearn models
+        X (array-like): Features matrix
+        y (array-like): Targets
+        folds (int): Number of cross-validation folds
+        n_jobs (int): Number of parallel jobs (-1 uses every core)
+        cache_folder (str): Folder of the fitted model cache. If None, nothing is cached.
+        seed (int): Seed of the fold split
+
+    Returns:
+        results (pd.DataFrame): One row per model with the mean (and std of the scores) over the folds
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    data_hash = datasetHash(X, y)
+    if cache_folder is not None:
+        os.makedirs(cache_folder, exist_ok=True)
+
+    splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed).split(X, y))
+    jobs = []
+    for m, model in enumerate(models):
+        for fold, (train_idx, test_idx) in enumerate(splits):
+            cache_path = None
+            if cache_folder is not None:
+                cache_path = os.path.join(cache_folder, f"{type(model).__name__}_{modelKey(model, data_hash, fold, folds, seed)}.joblib")
+            jobs.append((m, joblib.delayed(benchmarkFold)(model, X, y, train_idx, test_idx, cache_path)))
+
+    fold_results = joblib.Parallel(n_jobs=n_jobs)(job for _, job in jobs)
+
+    rows = []
+    for m, model in enumerate(models):
+        results = pd.DataFrame([r for (j, _), r in zip(jobs, fold_results) if j == m])
+        row = {"model": type(model).__name__}
+        for col in ["fit_time", "peak_rss_mb", "predict_rate"]:
+            row[col] = results[col].mean()
+        for col in ["accuracy", "f1", "precision", "recall"]:
+            row[col] = results[col].mean()
+            row[f"{col}_std"] = results[col].std(ddof=0)
+        row["cached_folds"] = int(results["cached"].sum())
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def parseArgs(argv=None):
+    """
+    Parses the command line arguments. Defaults are the constants at the top of this file.
+    """
+    parser = argparse.ArgumentParser(description="Cross-validate the models of modelExploration.py in parallel.")
+    parser.add_argument("--folds", type=int, default=FOLDS, help="number of cross-validation folds")
+    parser.add_argument("--jobs", type=int, default=N_JOBS, help="number of parallel jobs (-1 uses every core)")
+    parser.add_argument("--cache-dir", default=CACHE_FOLDER, help="folder of the fitted model cache")
+    parser.add_argument("--no-cache", action="store_true", help="refit every model and don't cache them")
+    parser.add_argument("--out", default=None, help="CSV file to save the results table to (default: timestamped file in outputs/)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parseArgs(argv)
+    X, y = me.loadDataset()
+
+    start = time.time()
+    results = benchmarkModels(me.models, X, y, folds=args.folds, n_jobs=args.jobs,
+                              cache_folder=None if args.no_cache else args.cache_dir)
+    end = time.time()
+
+    out_file = args.out or OUT_FOLDER + hf.getTime().strftime("%Y-%m-%d_%H%M_model_benchmark.csv")
+    os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok=True)
+    results.to_csv(out_file, index=False)
+
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.float_format", "{:.4f}".format):
+        print(results.to_string(index=False))
+    print(f"\nResults saved to {out_file}")
+    print(f"Total time elapsed: {hf.stringTime(start, end)}")
+
+if (__name__=="__main__"):
+    main()
@@ -9,6 +9,8 @@ from sklearn.naive_bayes import BernoulliNB, GaussianNB
 from sklearn.neural_network import MLPClassifier
 from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
 import helperFunctions as hf
+import shapeFeatures as sf
+import predictSites as pst
 
 # CONSTANTS
 
@@ -16,6 +18,15 @@ import helperFunctions as hf
 curr = os.path.dirname(__file__)
 DATA_FOLDER = os.path.join(curr, "../data/")
 
+# shape feature files saved by extractSamples.py --shape-table (<TF>_positive_shapes.npz / <TF>_negative_shapes.npz)
+# if set, these are used instead of the DNAShape text files below
+SHAPES_POS = None
+SHAPES_NEG = None
+
+# name of the model (class name, e.g. 'RandomForestClassifier') to refit on all the samples and save
+# to predictSites.MODEL_FILE for genome-wide prediction with predictSites.py; None saves nothing
+SAVE_MODEL = None
+
 # whether or not to print while running
 VERBOSE = False
 
@@ -30,21 +41,33 @@ models = [
     MLPClassifier()
 ]
 
-if (__name__=="__main__"):
-    # change these filenames as necessary
-    mgw_file_pos = DATA_FOLDER + "positive_UAK42_47304_MGW.txt"
-    roll_file_pos = DATA_FOLDER + "positive_UAK42_47304_Roll.txt"
-    proT_file_pos = DATA_FOLDER + "positive_UAK42_47304_ProT.txt"
-    helT_file_pos = DATA_FOLDER + "positive_UAK42_47304_HelT.txt"
+# change these filenames as necessary
+MGW_FILE_POS = DATA_FOLDER + "positive_UAK42_47304_MGW.txt"
+ROLL_FILE_POS = DATA_FOLDER + "positive_UAK42_47304_Roll.txt"
+PROT_FILE_POS = DATA_FOLDER + "positive_UAK42_47304_ProT.txt"
+HELT_FILE_POS = DATA_FOLDER + "positive_UAK42_47304_HelT.txt"
+
+MGW_FILE_NEG = DATA_FOLDER + "negative_UAK42_47304_MGW.txt"
+ROLL_FILE_NEG = DATA_FOLDER + "negative_UAK42_47304_Roll.txt"
+PROT_FILE_NEG = DATA_FOLDER + "negative_UAK42_47304_ProT.txt"
+HELT_FILE_NEG = DATA_FOLDER + "negative_UAK42_47304_HelT.txt"
 
-    mgw_file_neg = DATA_FOLDER + "negative_UAK42_47304_MGW.txt"
-    roll_file_neg = DATA_FOLDER + "negative_UAK42_47304_Roll.txt"
-    proT_file_neg = DATA_FOLDER + "negative_UAK42_47304_ProT.txt"
-    helT_file_neg = DATA_FOLDER + "negative_UAK42_47304_HelT.txt"
 
+def loadDataset():
+    """
+    Loads the DNA physical properties of the positive and negative samples and creates the features and targets matrices.
+
+    Returns:
+        X (pd.DataFrame): Features matrix, positive samples first
+        y (np.array): Targets (1 for positive samples, 0 for negative ones)
+    """
     # load DNA physical properties and create a features matrix
-    all_pos = hf.getFeatsAveraged(mgw_file_pos, roll_file_pos, proT_file_pos, helT_file_pos)
-    all_neg = hf.getFeatsAveraged(mgw_file_neg, roll_file_neg, proT_file_neg, helT_file_neg)
+    if (SHAPES_POS and SHAPES_NEG):
+        all_pos = hf.getFeatsAveraged(*sf.loadShapes(SHAPES_POS))
+        all_neg = hf.getFeatsAveraged(*sf.loadShapes(SHAPES_NEG))
+    else:
+        all_pos = hf.getFeatsAveraged(MGW_FILE_POS, ROLL_FILE_POS, PROT_FILE_POS, HELT_FILE_POS)
+        all_neg = hf.getFeatsAveraged(MGW_FILE_NEG, ROLL_FILE_NEG, PROT_FILE_NEG, HELT_FILE_NEG)
     X = pd.concat([all_pos, all_neg], axis=0)
 
     # create targets matrix
@@ -63,6 +86,11 @@ if (__name__=="__main__"):
         print(f"Neg targets: {targets_neg.shape}")
         print(f"    Final y: {y.shape}")
 
+    return X, y
+
+if (__name__=="__main__"):
+    X, y = loadDataset()
+
     # split into train/test sets
     X_train, X_test, y_train, y_test = train_test_split(X.values, 
                                                         y, 
@@ -96,3 +124,9 @@ if (__name__=="__main__"):
 
             hf.plot_confusion_matrix(y_test, y_pred)
 
+    # refit the chosen model on all the samples and save it for predictSites.py
+    if SAVE_MODEL:
+        model = [m for m in models if type(m).__name__ == SAVE_MODEL][0]
+        model.fit(X.values, y)
+        pst.saveModel(model, pst.MODEL_FILE, features="averaged")
+        print(f"Saved {SAVE_MODEL} to {pst.MODEL_FILE}")
@@ -0,0 +1,168 @@
+import os
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import confusion_matrix
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+# Data processing/model exploration helper functions, kept apart from helperFunctions.py so the extraction
+# helpers don't pay for importing pandas, scikit-learn, matplotlib and seaborn.
+# Everything here is still reachable as helperFunctions.<name> (imported on first use).
+
+def loadPhysicalPropertyArray(file, use_cache=True):
+    """
+    Loads a physical property text file downloaded from DNAShape (FASTA-like: a '>label' line followed by one line
+    of comma-separated values per sample) straight into a float32 NumPy array, with 'NA' values as NaN.
+    The parsed array is cached in a binary '<file>.cache.npz' next to the file, keyed by the file's mtime and size,
+    so later loads of an unchanged file skip the text parsing entirely.
+
+    Args:
+        file (str): Filepath of the physical property text file to be loaded
+        use_cache (bool): Whether to read/write the binary cache. Default is True.
+
+    Returns:
+        (np.array): float32 array of shape (num_samples, num_values)
+    """
+    cache_file = file + ".cache.npz"
+    stat = os.stat(file)
+    if (use_cache and os.path.isfile(cache_file)):
+        with np.load(cache_file) as cache:
+            if (float(cache["mtime"]) == stat.st_mtime and int(cache["size"]) == stat.st_size):
+                return cache["values"]
+
+    values = pd.read_csv(file, header=None, comment='>', na_values=['NA'], dtype=np.float32, engine='c').values
+    if use_cache:
+        try:
+            np.savez(cache_file, values=values, mtime=stat.st_mtime, size=stat.st_size)
+        except OSError:
+            pass # read-only folder, just don't cache
+    return values
+
+def loadPhysicalProperty(file):
+    """
+    Loads a physical property text file downloadoed from DNAShape and puts it into a Pandas dataframe.
+    Columns containing any missing values (the 'NA' ends of each sample) are dropped.
+
+    Args:
+        file (str): Filepath of the physical property text file to be loaded
+
+    Returns:
+        (pd.DataFrame): The physical properties loaded into a Pandas dataframe
+    """
+    return pd.DataFrame(loadPhysicalPropertyArray(file)).dropna(axis=1)
+
+def _propertyFrame(prop):
+    """
+    Returns a physical property as a dataframe (NaN columns dropped), given either the filepath of a DNAShape
+    text file or an array of values such as those from shapeFeatures.computeShapes().
+    """
+    if isinstance(prop, str):
+        return loadPhysicalProperty(prop)
+    return pd.DataFrame(np.asarray(prop)).dropna(axis=1)
+
+def getFeatsScaled(mgw_file, roll_file, pro_twist_file, hel_twist_file):
+    """
+    Takes filepaths for all 4 physical property files (mgw, roll, proT, helT) and concats them all into one big features matrix.
+    Concatenation is along axis=1. Values are all scaled with StandardScaler before concatenation.
+    Final output matrix size will be num_samples x (mgw.shape[1]+roll.shape[1]+pro_twist.shape[1]+hel_twist.shape[1])
+
+    Args:
+        mgw_file (str or np.array): Filepath to (or array of) the mgw properties
+        roll_file (str or np.array): Filepath to (or array of) the roll properties
+        pro_twist_file (str or np.array): Filepath to (or array of) the pro_twist properties
+        hel_twist_file (str or np.array): Filepath to (or array of) the hel_twist properties
+
+    Returns:
+        all_props (pd.DataFrame): All the scaled physical properties concatenated together along axis=1
+    """
+    mgw = _propertyFrame(mgw_file)
+    roll = _propertyFrame(roll_file)
+    pro_twist = _propertyFrame(pro_twist_file)
+    hel_twist = _propertyFrame(hel_twist_file)
+
+    scaler = StandardScaler()
+    mgw = pd.DataFrame(scaler.fit_transform(mgw.values))
+    roll = pd.DataFrame(scaler.fit_transform(roll.values))
+    pro_twist = pd.DataFrame(scaler.fit_transform(pro_twist.values))
+    hel_twist = pd.DataFrame(scaler.fit_transform(hel_twist.values))
+
+    all_props = pd.concat([mgw, roll, pro_twist, hel_twist], axis=1)
+
+    return all_props
+
+def getFeatsAveraged(mgw_file, roll_file, pro_twist_file, hel_twist_file):
+    """
+    Takes filepaths for all 4 physical property files (mgw, roll, proT, helT) and concats them all into one big features matrix.
+    Concatenation is along axis=1. Values in each row are averaged before concatenation.
+    Final output matrix size will be num_samples x 4
+
+    Args:
+        mgw_file (str or np.array): Filepath to (or array of) the mgw properties
+        roll_file (str or np.array): Filepath to (or array of) the roll properties
+        pro_twist_file (str or np.array): Filepath to (or array of) the pro_twist properties
+        hel_twist_file (str or np.array): Filepath to (or array of) the hel_twist properties
+
+    Returns:
+        all_props (pd.DataFrame): All the averaged physical properties concatenated together along axis=1
+    """
+    mgw = _propertyFrame(mgw_file).mean(axis=1)
+    roll = _propertyFrame(roll_file).mean(axis=1)
+    pro_twist = _propertyFrame(pro_twist_file).mean(axis=1)
+    hel_twist = _propertyFrame(hel_twist_file).mean(axis=1)
+
+    all_props = pd.concat([mgw, roll, pro_twist, hel_twist], axis=1)
+
+    return all_props
+
+def getFeatsScaledAndAveraged(mgw_file, roll_file, pro_twist_file, hel_twist_file):
+    """
+    Takes filepaths for all 4 physical property files (mgw, roll, proT, helT) and concats them all into one big features matrix.
+    Concatenation is along axis=1. Values in each row are scaled and then averaged before concatenation.
+    Final output matrix size will be num_samples x 4
+
+    Args:
+        mgw_file (str or np.array): Filepath to (or array of) the mgw properties
+        roll_file (str or np.array): Filepath to (or array of) the roll properties
+        pro_twist_file (str or np.array): Filepath to (or array of) the pro_twist properties
+        hel_twist_file (str or np.array): Filepath to (or array of) the hel_twist properties
+
+    Returns:
+        all_props (pd.DataFrame): All the averaged physical properties concatenated together along axis=1
+    """
+    mgw = _propertyFrame(mgw_file)
+    roll = _propertyFrame(roll_file)
+    pro_twist = _propertyFrame(pro_twist_file)
+    hel_twist = _propertyFrame(hel_twist_file)
+
+    scaler = StandardScaler()
+    mgw = pd.DataFrame(scaler.fit_transform(mgw.values))
+    roll = pd.DataFrame(scaler.fit_transform(roll.values))
+    pro_twist = pd.DataFrame(scaler.fit_transform(pro_twist.values))
+    hel_twist = pd.DataFrame(scaler.fit_transform(hel_twist.values))
+
+    mgw = mgw.mean(axis=1)
+    roll = roll.mean(axis=1)
+    pro_twist = pro_twist.mean(axis=1)
+    hel_twist = hel_twist.mean(axis=1)
+
+    all_props = pd.concat([mgw, roll, pro_twist, hel_twist], axis=1)
+
+    return all_props
+
+# adapted from https://stackoverflow.com/questions/19233771/sklearn-plot-confusion-matrix-with-labels
+def plot_confusion_matrix(y_test, y_pred):
+    # get confusion matrix from predictions
+    cm = confusion_matrix(y_test, y_pred)
+
+    # plot confusion matrix
+    ax = plt.subplot()
+    sns.heatmap(cm, annot=True, fmt='g', ax=ax, cmap='Greens')
+    
+    # labels, title and ticks
+    ax.set_xlabel('Predicted')
+    ax.set_ylabel('True')
+    ax.xaxis.set_ticklabels(['positive', 'negative'])
+    ax.yaxis.set_ticklabels(['positive', 'negative'])
+    ax.set_title('Confusion Matrix')
+    plt.show()
\ No newline at end of file
@@ -0,0 +1,149 @@
+import os
+import math
+import numpy as np
+
+# CONSTANTS
+
+# data folder location
+curr = os.path.dirname(__file__)
+DATA_FOLDER = os.path.join(curr, "../data/")
+PWM_FILE = DATA_FOLDER + "factorbookMotifPwm.txt"
+
+# nucleotide order of the rows of every PWM
+NTS = "ACGT"
+
+# the parsed library, built once per process by getLibrary()
+_library = None
+
+
+class MotifLibrary:
+    """
+    Class holding every PWM of a factorbook-style PWM file as NumPy matrices of shape (4, motif length),
+    rows in ACGT order. Parsing the text file is done once, after which the library is cached in a binary
+    .npz file next to it and reloaded from there as long as the text file hasn't changed.
+    Constructor takes a dict mapping TF name -> PWM matrix.
+    """
+    def __init__(self, pwms):
+        self.pwms = {name: np.asarray(pwm, dtype=np.float64) for name, pwm in pwms.items()}
+
+
+    def __contains__(self, TF):
+        return TF in self.pwms
+
+
+    def __getitem__(self, TF):
+        return self.pwms[TF]
+
+
+    def __len__(self):
+        return len(self.pwms)
+
+
+    def names(self):
+        return list(self.pwms)
+
+
+    def logOdds(self, TF, pseudocounts=0.0, background=None):
+        """
+        Returns the log-odds (PSSM) matrix of a TF, ready for pwmScanner. Computed the same way as BioPython's
+        motif.pssm (normalized columns, log2(p/b)), so scores and hits match a motifs.read() of the JASPAR file.
+
+        Args:
+            TF (str): Name of the TF
+            pseudocounts (float): Pseudocount added to every entry before normalizing. Default is 0.
+            background (list): Background frequencies of A, C, G, T. Default is uniform.
+
+        Returns:
+            (np.array): Log-odds matrix of shape (motif length, 4), columns in ACGT order
+        """
+        pwm = self.pwms[TF]
+        if background is None:
+            background = [1.0]*4
+        background = [b / sum(background) for b in background]
+
+        logodds = np.empty((pwm.shape[1], 4))
+        for i in range(pwm.shape[1]):
+            column = [float(x) + pseudocounts for x in pwm[:, i]]
+            total = sum(column)
+            for j in range(4):
+                p, b = column[j] / total, background[j]
+                if (b > 0):
+                    logodds[i, j] = math.log(p / b, 2) if p > 0 else -math.inf
+                else:
+                    logodds[i, j] = math.inf if p > 0 else math.nan
+        return logodds
+
+
+    def save(self, cache_file, source_mtime=0.0):
+        """
+        Saves the library to a binary .npz file. All matrices are stored side by side in one array.
+        """
+        names = self.names()
+        lengths = np.array([self.pwms[n].shape[1] for n in names], dtype=np.int64)
+        matrix = np.concatenate([self.pwms[n] for n in names], axis=1) if names else np.empty((4, 0))
+        np.savez(cache_file, names=np.array(names), lengths=lengths, matrix=matrix, source_mtime=source_mtime)
+
+
+    @classmethod
+    def fromCache(cls, cache_file):
+        """
+        Loads a library saved with save().
+        """
+        with np.load(cache_file) as cache:
+            splits = np.cumsum(cache["lengths"])[:-1]
+            return cls(dict(zip(cache["names"].tolist(), np.split(cache["matrix"], splits, axis=1))))
+
+
+    @classmethod
+    def fromText(cls, pwm_file):
+        """
+        Parses a factorbookMotifPwm file (name, length, then one comma-separated list of values per nucleotide).
+        """
+        pwms = {}
+        with open(pwm_file) as f:
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                pwms[fields[0]] = [[float(x) for x in row.split(',') if x != ''] for row in fields[2:]]
+        return cls(pwms)
+
+
+    @classmethod
+    def load(cls, pwm_file=PWM_FILE, cache_file=None):
+        """
+        Loads a library from its binary cache if it is up to date, otherwise parses the text file and
+        (re)writes the cache.
+
+        Args:
+            pwm_file (str): Filepath of the factorbookMotifPwm file
+            cache_file (str): Filepath of the binary cache. Defaults to pwm_file + '.cache.npz'.
+
+        Returns:
+            (MotifLibrary): The library
+        """
+        if cache_file is None:
+            cache_file = pwm_file + ".cache.npz"
+        mtime = os.path.getmtime(pwm_file)
+        if os.path.isfile(cache_file):
+            with np.load(cache_file) as cache:
+                up_to_date = float(cache["source_mtime"]) == mtime
+            if up_to_date:
+                return cls.fromCache(cache_file)
+
+        library = cls.fromText(pwm_file)
+        try:
+            library.save(cache_file, source_mtime=mtime)
+        except OSError:
+            pass # read-only data folder, just don't cache
+        return library
+
+
+def getLibrary():
+    """
+    Returns the motif library of the factorbook PWM file in the data folder, loading it once per process.
+    """
+    global _library
+    if _library is None:
+        _library = MotifLibrary.load()
+    return _library
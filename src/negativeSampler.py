@@ -0,0 +1,166 @@
+import numpy as np
+
+# CONSTANTS
+
+# number of GC content buckets (equal width over 0-100% GC)
+GC_BINS = 10
+
+# width (in PWM score units) of the score buckets
+SCORE_BIN_WIDTH = 1.0
+
+# number of score buckets; scores beyond the last one are put in it
+SCORE_BINS = 32
+
+# codes of G and C in encoded sequences (see pwmScanner)
+GC_CODES = (1, 2)
+
+
+def windowGC(encoded, positions, length):
+    """
+    Returns the GC content (fraction, 0-1) of the windows of a given length starting at each position
+    of an encoded sequence.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    codes = encoded[positions[:, None] + np.arange(length)]
+    return ((codes == GC_CODES[0]) | (codes == GC_CODES[1])).mean(axis=1) if len(positions) else np.empty(0)
+
+def bucketKeys(gc, scores, threshold):
+    """
+    Returns the bucket of each hit as a single integer (score bucket * GC_BINS + GC bucket).
+    Score buckets are SCORE_BIN_WIDTH wide, starting from the scan threshold.
+    """
+    gc_bin = np.clip((np.asarray(gc) * GC_BINS).astype(np.int64), 0, GC_BINS - 1)
+    score_bin = np.clip(((np.asarray(scores, dtype=np.float64) - threshold) // SCORE_BIN_WIDTH).astype(np.int64), 0, SCORE_BINS - 1)
+    return score_bin * GC_BINS + gc_bin
+
+
+class NegativeSampler:
+    """
+    Class holding an index of the candidate negative samples (unbound PWM hits) of a TF on a chromosome,
+    bucketed by GC content and PWM score, along with the buckets of the positive samples they are matched to.
+    Candidates are stored sorted by bucket (CSR layout: one array of positions plus the offset of each bucket),
+    so a matched sample is drawn bucket by bucket without looking at the other candidates.
+    The index is saved to disk with save(), so negatives can be re-drawn (other ratio or seed) without rescanning.
+    Constructor takes the threshold used for the scan.
+    """
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self._chunks = []
+        self._pos_chunks = []
+        self.positions = self.strands = self.offsets = self.pos_counts = None
+
+
+    def addCandidates(self, positions, strands, gc, scores):
+        """
+        Adds a chunk of unbound hits to the index.
+        """
+        self._chunks.append((np.asarray(positions, dtype=np.int64), np.asarray(strands, dtype=np.int8),
+                             bucketKeys(gc, scores, self.threshold)))
+
+
+    def addPositives(self, gc, scores):
+        """
+        Adds a chunk of positive samples the negatives are to be matched to (only their buckets are kept).
+        """
+        self._pos_chunks.append(bucketKeys(gc, scores, self.threshold))
+
+
+    def build(self):
+        """
+        Sorts the candidates added so far into their buckets. Called automatically by save() and draw().
+        """
+        if self.positions is not None:
+            if not self._chunks and not self._pos_chunks:
+                return
+            # keep what was indexed before
+            n_buckets = len(self.offsets) - 1
+            self._chunks.insert(0, (self.positions, self.strands, np.repeat(np.arange(n_buckets), np.diff(self.offsets))))
+            self._pos_chunks.insert(0, np.repeat(np.arange(n_buckets), self.pos_counts))
+
+        n_buckets = SCORE_BINS * GC_BINS
+        if self._chunks:
+            positions, strands, keys = (np.concatenate(arrays) for arrays in zip(*self._chunks))
+        else:
+            positions, strands, keys = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8), np.empty(0, dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        self.positions, self.strands = positions[order], strands[order]
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(keys, minlength=n_buckets))))
+        pos_keys = np.concatenate(self._pos_chunks) if self._pos_chunks else np.empty(0, dtype=np.int64)
+        self.pos_counts = np.bincount(pos_keys, minlength=n_buckets)
+        self._chunks, self._pos_chunks = [], []
+
+
+    def __len__(self):
+        self.build()
+        return len(self.positions)
+
+
+    def allocate(self, ratio=1):
+        """
+        Decides how many negatives to draw from each bucket: ratio per positive in the positive's bucket, or,
+        where a bucket runs out, from the nearest buckets (by GC and score bucket distance) that have some left.
+
+        Returns:
+            (np.array): Number of negatives to draw from each bucket
+        """
+        self.build()
+        available = np.diff(self.offsets)
+        need = np.round(self.pos_counts * ratio).astype(np.int64)
+        alloc = np.minimum(need, available)
+        short = need - alloc
+
+        score_bin, gc_bin = np.divmod(np.arange(len(available)), GC_BINS)
+        for bucket in np.flatnonzero(short):
+            distance = np.abs(score_bin - score_bin[bucket]) + np.abs(gc_bin - gc_bin[bucket])
+            for other in np.lexsort((np.arange(len(available)), distance)):
+                if short[bucket] == 0:
+                    break
+                take = min(short[bucket], available[other] - alloc[other])
+                alloc[other] += take
+                short[bucket] -= take
+        return alloc
+
+
+    def draw(self, ratio=1, seed=0):
+        """
+        Draws a reproducible GC- and score-matched sample of negatives, without replacement.
+        Each bucket's share is drawn with Generator.choice(), which only does work proportional to the
+        number drawn, not to the size of the bucket.
+
+        Args:
+            ratio (float): Number of negatives per positive sample (e.g. 1 for 1:1, 5 for 1:5)
+            seed (int or sequence): Seed of the random generator
+
+        Returns:
+            positions (np.array): Start positions of the negatives, sorted
+            strands (np.array): Their strands
+        """
+        alloc = self.allocate(ratio)
+        rng = np.random.default_rng(seed)
+        picked = [self.offsets[b] + rng.choice(self.offsets[b+1] - self.offsets[b], n, replace=False)
+                  for b, n in enumerate(alloc) if n > 0]
+        idx = np.sort(np.concatenate(picked)) if picked else np.empty(0, dtype=np.int64)
+        positions, strands = self.positions[idx], self.strands[idx]
+        order = np.argsort(positions, kind="stable")
+        return positions[order], strands[order]
+
+
+    def save(self, file):
+        """
+        Saves the index to a binary .npz file (path or open binary file).
+        """
+        self.build()
+        np.savez(file, threshold=self.threshold, positions=self.positions, strands=self.strands,
+                 offsets=self.offsets, pos_counts=self.pos_counts)
+
+
+    @classmethod
+    def load(cls, file):
+        """
+        Loads an index saved with save().
+        """
+        with np.load(file) as index:
+            sampler = cls(float(index["threshold"]))
+            sampler.positions, sampler.strands = index["positions"], index["strands"]
+            sampler.offsets, sampler.pos_counts = index["offsets"], index["pos_counts"]
+        return sampler
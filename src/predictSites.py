@@ -0,0 +1,197 @@
+import os
+import time
+import gzip
+import hashlib
+import argparse
+import numpy as np
+import joblib
+import helperFunctions as hf
+import pwmScanner as ps
+import genomeStore as gs
+import motifLibrary as ml
+import shapeFeatures as sf
+import extractSamples as es
+import sequenceCache as sc
+
+# CONSTANTS
+
+# folder locations
+curr = os.path.dirname(__file__)
+OUT_FOLDER = os.path.join(curr, "../outputs/")
+
+# model saved by modelExploration.py (see saveModel())
+MODEL_FILE = OUT_FOLDER + "model.joblib"
+
+# number of PWM hits featurized and predicted at a time (bounds memory use)
+BATCH_SIZE = 2**16
+
+# number of unique sequences whose predictions are memoized (0 disables), and an optional file they are kept in
+# between runs (only reused with the same model and shape table)
+CACHE_SIZE = sc.CACHE_SIZE
+CACHE_FILE = None
+
+# featurizations a model can be trained on, by name
+FEATURIZERS = {
+    "averaged": sf.averageShapes,
+    "concatenated": sf.concatShapes,
+}
+
+
+def saveModel(model, model_file=MODEL_FILE, features="averaged"):
+    """
+    Saves a fitted model along with the name of the featurization it was trained on.
+
+    Args:
+        model (sklearn estimator): The fitted model
+        model_file (str): Filepath to save it to
+        features (str): Key of FEATURIZERS the training features were made with
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(model_file)), exist_ok=True)
+    joblib.dump({"model": model, "features": features}, model_file)
+
+def loadModel(model_file=MODEL_FILE):
+    """
+    Loads a model saved with saveModel().
+
+    Returns:
+        model (sklearn estimator): The fitted model
+        featurize (function): Function turning the output of shapeFeatures.computeShapes() into its features matrix
+    """
+    entry = joblib.load(model_file)
+    return entry["model"], FEATURIZERS[entry["features"]]
+
+def predictBatch(model, featurize, sequences, table_file, cache=None):
+    """
+    Featurizes a batch of sequences and predicts whether each one is bound.
+    If cache (a sequenceCache.SequenceCache) is given, each distinct sequence is only featurized and predicted once.
+
+    Returns:
+        probs (np.array): Probability of each site being bound (NaN for sites that couldn't be featurized)
+        labels (np.array): Predicted label of each site (1 bound, 0 unbound, -1 not featurized)
+    """
+    if cache is not None:
+        rows = cache.compute(sequences, lambda seqs: np.column_stack(predictBatch(model, featurize, seqs, table_file)))
+        return rows[:, 0], rows[:, 1].astype(np.int8)
+
+    X = featurize(sf.computeShapes(sequences, table_file))
+    ok = ~np.isnan(X).any(axis=1)
+    probs = np.full(len(X), np.nan)
+    labels = np.full(len(X), -1, dtype=np.int8)
+    if ok.any():
+        labels[ok] = model.predict(X[ok])
+        if hasattr(model, "predict_proba"):
+            probs[ok] = model.predict_proba(X[ok])[:, list(model.classes_).index(1)]
+    return probs, labels
+
+def predictChromosome(chromosome, logodds, model, featurize, out, threshold=es.PWM_THRESH,
+                      table_file=sf.PENTAMER_TABLE, batch_size=BATCH_SIZE, bound_only=False, strand=es.STRAND,
+                      encoded=None, cache=None):
+    """
+    Scores every PWM hit of one or more TFs on a chromosome's active regions with a trained model, writing the
+    sites out as BED lines (chrom, start, end, TF, PWM score, strand, probability, predicted label). Hits are
+    taken from the same streaming scan as extractSamples.py and predicted batch_size at a time, so memory use
+    doesn't grow with the number of hits.
+
+    Args:
+        chromosome (str): Name of the chromosome
+        logodds (dict): Mapping of TF name -> log-odds matrix of its PWM
+        model (sklearn estimator): The fitted model
+        featurize (function): Featurization the model was trained on (from loadModel())
+        out (file): Open text file the BED lines are written to
+        threshold (float): Threshold for the PWM search
+        table_file (str): Filepath of the pentamer shape table
+        batch_size (int): Number of hits predicted at a time
+        bound_only (bool): Whether to only write out the sites predicted to be bound
+        strand (str): '+' to only score hits on the positive strand, 'both' for both strands
+                      (negative strand sites are featurized reverse complemented, as in extractSamples.py)
+        encoded (np.array): The encoded chromosome, if already loaded (e.g. by genomeStore.prefetchChromosomes())
+        cache (sequenceCache.SequenceCache): If given, predictions are memoized by sequence
+
+    Returns:
+        n_sites (int): Number of hits scored
+        n_bound (int): Number of them predicted to be bound
+    """
+    if encoded is None:
+        encoded = gs.loadChromosome(chromosome, es.CHR_FOLDER, es.STORE_FOLDER)
+    active_regions = np.asarray(hf.getActiveRegions(chromosome), dtype=np.int64).reshape(-1, 2)
+
+    n_sites, n_bound = 0, 0
+    for TF, positions, scores, strands in es.scanStage(encoded, logodds, active_regions, threshold, {}, strand):
+        motif_len = logodds[TF].shape[0]
+        for i in range(0, len(positions), batch_size):
+            pos, score, strand_signs = positions[i:i+batch_size], scores[i:i+batch_size], strands[i:i+batch_size]
+            sequences = ps.decodeWindows(encoded, pos, motif_len, strand_signs)
+            probs, labels = predictBatch(model, featurize, sequences, table_file, cache)
+            keep = labels == 1 if bound_only else np.ones(len(pos), dtype=bool)
+            out.writelines(f"{chromosome}\t{p}\t{p + motif_len}\t{TF}\t{s:.3f}\t{'+' if sign > 0 else '-'}\t{prob:.4f}\t{label}\n"
+                           for p, s, sign, prob, label in zip(pos[keep], score[keep], strand_signs[keep], probs[keep], labels[keep]))
+            n_sites += len(pos)
+            n_bound += int((labels == 1).sum())
+    return n_sites, n_bound
+
+def parseArgs(argv=None):
+    """
+    Parses the command line arguments. Defaults are the constants at the top of this file and extractSamples.py.
+    """
+    parser = argparse.ArgumentParser(description="Predict which PWM hits on active regions are bound with a trained model.")
+    parser.add_argument("--model", default=MODEL_FILE, help="model saved by modelExploration.py")
+    parser.add_argument("--tfs", nargs="+", default=es.tfs, help="transcription factors to predict binding sites of")
+    parser.add_argument("--chromosomes", nargs="+", default=es.CHRS, help="chromosomes to search on")
+    parser.add_argument("--threshold", type=float, default=es.PWM_THRESH, help="threshold for the PWM search")
+    parser.add_argument("--strand", choices=["+", "both"], default=es.STRAND,
+                        help="score hits on the positive strand only, or on both strands")
+    parser.add_argument("--shape-table", default=sf.PENTAMER_TABLE, help="pentamer shape table")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="number of sites predicted at a time")
+    parser.add_argument("--prefetch", type=int, default=es.PREFETCH,
+                        help="number of chromosomes loaded ahead on a background thread (0 disables)")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE,
+                        help="number of unique sequences whose predictions are memoized (0 disables)")
+    parser.add_argument("--cache-file", default=CACHE_FILE, help="file the memoized predictions are kept in between runs")
+    parser.add_argument("--bound-only", action="store_true", help="only write out sites predicted to be bound")
+    parser.add_argument("--out", default=None,
+                        help="BED file to write (.gz to compress; default: timestamped file in outputs/)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parseArgs(argv)
+    out_file = args.out or OUT_FOLDER + hf.getTime().strftime("%Y-%m-%d_%H%M_predicted_sites.bed")
+    os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok=True)
+
+    model, featurize = loadModel(args.model)
+    library = ml.getLibrary()
+    logodds = {TF: library.logOdds(TF) for TF in args.tfs}
+
+    # predictions memoized by sequence, tagged with the model and shape table they were made with
+    cache = None
+    if args.cache_size > 0:
+        tag = hashlib.sha1()
+        for path in (args.model, args.shape_table):
+            with open(path, "rb") as f:
+                tag.update(f.read())
+        cache = sc.SequenceCache(args.cache_size, args.cache_file, tag.hexdigest())
+
+    total_start = time.time()
+    total_sites, total_bound = 0, 0
+    opener = gzip.open if out_file.endswith(".gz") else open
+    with opener(out_file, "wt") as out:
+        for chromosome, encoded in gs.prefetchChromosomes(args.chromosomes, es.CHR_FOLDER, es.STORE_FOLDER, args.prefetch):
+            chr_start = time.time()
+            n_sites, n_bound = predictChromosome(chromosome, logodds, model, featurize, out, args.threshold,
+                                                 args.shape_table, args.batch_size, args.bound_only, args.strand, encoded, cache)
+            elapsed = time.time() - chr_start
+            print(f"{chromosome}: {n_sites:,} sites scored, {n_bound:,} predicted bound ({n_sites / max(elapsed, 1e-9):,.0f} sites/s)")
+            total_sites += n_sites
+            total_bound += n_bound
+
+    elapsed = time.time() - total_start
+    print("\n----------------------------------------------------")
+    print(f"{total_sites:,} sites scored, {total_bound:,} predicted bound ({total_sites / max(elapsed, 1e-9):,.0f} sites/s)")
+    if cache is not None:
+        print(f"Prediction cache: {cache.summary()}")
+        if args.cache_file:
+            cache.save()
+    print(f"Predicted sites saved to {out_file}")
+    print(f"Total time elapsed: {hf.stringTime(total_start, time.time())}\n")
+
+if (__name__=="__main__"):
+    main()
@@ -0,0 +1,306 @@
+import numpy as np
+
+# CONSTANTS
+
+# nucleotide order used for every encoded sequence and log-odds matrix
+NTS = "ACGT"
+
+# integer code given to any letter that isn't A, C, G or T (N, gaps etc)
+N_CODE = 4
+
+# complement of each code (A<->T, C<->G, N stays N)
+COMPLEMENT = np.array([3, 2, 1, 0, N_CODE], dtype=np.uint8)
+
+# lookup table from ASCII byte to nucleotide code (case insensitive)
+ENCODE_TABLE = np.full(256, N_CODE, dtype=np.uint8)
+for _i, _nt in enumerate(NTS):
+    ENCODE_TABLE[ord(_nt)] = _i
+    ENCODE_TABLE[ord(_nt.lower())] = _i
+
+# lookup table from nucleotide code back to (uppercase) ASCII byte
+DECODE_TABLE = np.frombuffer(b"ACGTN", dtype=np.uint8)
+
+# default number of windows scored per batch (bounds memory use of a scan)
+CHUNK_SIZE = 2**20
+
+
+def encodeSequence(sequence):
+    """
+    Encodes a DNA sequence as a uint8 array of nucleotide codes (A=0, C=1, G=2, T=3, anything else=4).
+    Lowercase (soft-masked) letters are encoded the same as uppercase ones.
+
+    Args:
+        sequence (str, bytes or Bio.Seq): The DNA sequence to encode
+
+    Returns:
+        (np.array): The encoded sequence as a uint8 array of the same length
+    """
+    if isinstance(sequence, str):
+        sequence = sequence.encode("ascii")
+    return ENCODE_TABLE[np.frombuffer(bytes(sequence), dtype=np.uint8)]
+
+def encodeWindows(encoded, positions, length, strands=None):
+    """
+    Extracts the windows of a given length starting at each position of an encoded sequence, as nucleotide codes.
+
+    Args:
+        encoded (np.array): Sequence encoded with encodeSequence()
+        positions (array-like): Start positions of the windows (positive strand coordinates)
+        length (int): Length of the windows
+        strands (array-like): Strand of each window (1 or -1, as returned by scanRegions()). Windows on the
+                              negative strand are reverse complemented. If None, all are on the positive strand.
+
+    Returns:
+        (np.array): uint8 array of shape (number of windows, length)
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    codes = encoded[positions[:, None] + np.arange(length)]
+    if strands is not None:
+        minus = np.asarray(strands) < 0
+        codes[minus] = COMPLEMENT[codes[minus, ::-1]]
+    return codes
+
+def windowsToBytes(codes):
+    """
+    Decodes windows of nucleotide codes (as returned by encodeWindows()) into an array of uppercase bytes
+    strings (dtype 'S<length>'). Any code that isn't A, C, G or T is decoded as 'N'.
+    """
+    codes = np.asarray(codes).reshape(len(codes), -1)
+    return np.ascontiguousarray(DECODE_TABLE[codes]).view(f"S{codes.shape[1]}").ravel()
+
+def decodeWindows(encoded, positions, length, strands=None):
+    """
+    Extracts the windows of a given length starting at each position of an encoded sequence, as uppercase bytes.
+    Any code that isn't A, C, G or T is decoded as 'N'.
+
+    Args:
+        encoded (np.array): Sequence encoded with encodeSequence()
+        positions (array-like): Start positions of the windows (positive strand coordinates)
+        length (int): Length of the windows
+        strands (array-like): Strand of each window (1 or -1, as returned by scanRegions()). Windows on the
+                              negative strand are reverse complemented. If None, all are on the positive strand.
+
+    Returns:
+        (np.array): Array of bytes strings (dtype 'S<length>'), one per window
+    """
+    return windowsToBytes(encodeWindows(encoded, positions, length, strands))
+
+def pssmToArray(pssm):
+    """
+    Converts a BioPython position-specific scoring matrix into a log-odds array usable by the scanner.
+
+    Args:
+        pssm (Bio.motifs.matrix.PositionSpecificScoringMatrix): The PSSM, e.g. motif.pssm
+
+    Returns:
+        (np.array): Log-odds matrix of shape (motif length, 4), columns in ACGT order
+    """
+    return np.array([pssm[nt] for nt in NTS], dtype=np.float64).T
+
+def scoringTables(logodds):
+    """
+    Builds the lookup tables used to score windows on both strands. Each table has shape (motif length, 5)
+    where the 5th column (code 4) is NaN, so any window containing an N never passes the threshold.
+
+    Args:
+        logodds (np.array): Log-odds matrix of shape (motif length, 4), columns in ACGT order
+
+    Returns:
+        fwd_table (np.array): Table for the positive strand
+        rev_table (np.array): Table for the reverse complement of the motif (negative strand)
+    """
+    logodds = np.asarray(logodds, dtype=np.float64)
+    fwd_table = np.full((logodds.shape[0], 5), np.nan)
+    fwd_table[:, :4] = logodds
+    rev_table = fwd_table[::-1][:, COMPLEMENT]
+    return fwd_table, rev_table
+
+def regionBlocks(regions, motif_len, chunk_size=CHUNK_SIZE):
+    """
+    Generator that splits a set of regions into blocks of at most ~chunk_size windows. Each block is the
+    concatenation of a few region spans, so it can be gathered from the encoded sequence in one call and
+    scored with contiguous slices. Regions longer than chunk_size are split into overlapping pieces.
+
+    Args:
+        regions (array-like): (n, 2) array of [start, end) region coordinates
+        motif_len (int): Length of the windows
+        chunk_size (int): Approximate maximum number of windows per block
+
+    Yields:
+        positions (np.array): int64 sequence positions making up the block
+        valid (np.array): Boolean mask (length len(positions)-motif_len+1) of the block offsets where a
+                          window lies fully inside one region
+    """
+    regions = np.asarray(regions, dtype=np.int64).reshape(-1, 2)
+    regions = regions[regions[:, 1] - regions[:, 0] >= motif_len]
+    if len(regions) == 0:
+        return
+
+    # split long regions into pieces of at most chunk_size windows
+    n_windows = regions[:, 1] - regions[:, 0] - motif_len + 1
+    n_pieces = -(-n_windows // chunk_size)
+    piece_region = np.repeat(np.arange(len(regions)), n_pieces)
+    piece_idx = np.arange(n_pieces.sum()) - np.repeat(np.cumsum(n_pieces) - n_pieces, n_pieces)
+    piece_starts = regions[piece_region, 0] + piece_idx*chunk_size
+    piece_ends = np.minimum(piece_starts + chunk_size + motif_len - 1, regions[piece_region, 1])
+
+    # group consecutive pieces into blocks
+    piece_windows = piece_ends - piece_starts - motif_len + 1
+    group = (np.cumsum(piece_windows) - 1) // chunk_size
+    splits = np.flatnonzero(np.diff(group)) + 1
+    for starts, ends in zip(np.split(piece_starts, splits), np.split(piece_ends, splits)):
+        lens = ends - starts
+        offsets = np.arange(lens.sum(), dtype=np.int64) - np.repeat(np.cumsum(lens) - lens, lens)
+        positions = np.repeat(starts, lens) + offsets
+        valid = (offsets <= np.repeat(lens - motif_len, lens))[:len(positions) - motif_len + 1]
+        yield positions, valid
+
+def scoreWindows(block, fwd_table, rev_table=None):
+    """
+    Scores every window of an encoded block of sequence.
+    Scores are accumulated in float64 and returned as float32, exactly like BioPython's pssm.calculate().
+
+    Args:
+        block (np.array): Encoded sequence (or concatenation of encoded spans) to score
+        fwd_table (np.array): Positive strand table from scoringTables()
+        rev_table (np.array): Negative strand table from scoringTables(). If None, only the positive strand is scored.
+
+    Returns:
+        fwd_scores (np.array): float32 positive strand scores, one per window start
+        rev_scores (np.array): float32 negative strand scores (None if rev_table is None)
+    """
+    motif_len = fwd_table.shape[0]
+    n = len(block) - motif_len + 1
+    # take() is much faster with native integer indices than with uint8 ones
+    if (block.dtype != np.intp):
+        block = block.astype(np.intp)
+    fwd_scores = np.zeros(n)
+    rev_scores = None if rev_table is None else np.zeros(n)
+    for j in range(motif_len):
+        codes = block[j:j+n]
+        fwd_scores += fwd_table[j].take(codes)
+        if rev_table is not None:
+            rev_scores += rev_table[j].take(codes)
+
+    fwd_scores = fwd_scores.astype(np.float32)
+    if rev_table is not None:
+        rev_scores = rev_scores.astype(np.float32)
+    return fwd_scores, rev_scores
+
+def windowScores(encoded, positions, logodds, strands=None):
+    """
+    Scores the windows starting at given positions of an encoded sequence on their own strand, giving exactly
+    the scores the scan reported for them (windows containing an N score NaN).
+
+    Args:
+        encoded (np.array): Sequence encoded with encodeSequence()
+        positions (array-like): Start positions of the windows (positive strand coordinates)
+        logodds (np.array): Log-odds matrix of shape (motif length, 4), columns in ACGT order
+        strands (array-like): Strand of each window (1 or -1). If None, all are on the positive strand.
+
+    Returns:
+        (np.array): float32 scores, one per window
+    """
+    fwd_table, rev_table = scoringTables(logodds)
+    codes = encodeWindows(encoded, positions, fwd_table.shape[0]).astype(np.intp)
+    minus = np.zeros(len(codes), dtype=bool) if strands is None else np.asarray(strands) < 0
+    scores = np.zeros(len(codes))
+    for j in range(fwd_table.shape[0]):
+        scores += np.where(minus, rev_table[j].take(codes[:, j]), fwd_table[j].take(codes[:, j]))
+    return scores.astype(np.float32)
+
+def _blockHits(block_pos, valid, fwd_scores, rev_scores, threshold):
+    """
+    Picks out the hits of one scored block, in scan order (positive strand first when both strands
+    hit the same window).
+    """
+    idx = [np.flatnonzero(valid & (fwd_scores >= threshold))]
+    scores = [fwd_scores[idx[0]]]
+    strands = [np.ones(len(idx[0]), dtype=np.int8)]
+    if rev_scores is not None:
+        idx.append(np.flatnonzero(valid & (rev_scores >= threshold)))
+        scores.append(rev_scores[idx[1]])
+        strands.append(np.full(len(idx[1]), -1, dtype=np.int8))
+
+    idx = np.concatenate(idx)
+    order = np.argsort(idx, kind="stable")
+    return block_pos[idx[order]], np.concatenate(scores)[order], np.concatenate(strands)[order]
+
+def iterScanRegionsMulti(encoded, logodds, regions, threshold, both=True, chunk_size=CHUNK_SIZE):
+    """
+    Generator version of scanRegionsMulti(): yields the hits of each block as soon as it is scored, so memory
+    use is bounded by chunk_size rather than by the total number of hits. Hits of each TF come out in scan order.
+    Arguments are the same as for scanRegionsMulti().
+
+    Yields:
+        TF (str): Name of the TF the hits are for
+        positions, scores, strands (np.array): Hits of the TF in the block, as returned by scanRegions()
+    """
+    groups = {}
+    for TF, matrix in logodds.items():
+        groups.setdefault(np.shape(matrix)[0], []).append(TF)
+
+    for motif_len, group in groups.items():
+        tables = {}
+        for TF in group:
+            fwd_table, rev_table = scoringTables(logodds[TF])
+            tables[TF] = (fwd_table, rev_table if both else None)
+        group_regions = regions(motif_len) if callable(regions) else regions
+        group_regions = np.clip(np.asarray(group_regions, dtype=np.int64).reshape(-1, 2), 0, len(encoded))
+
+        for block_pos, valid in regionBlocks(group_regions, motif_len, chunk_size):
+            block = encoded[block_pos].astype(np.intp)
+            for TF in group:
+                fwd_scores, rev_scores = scoreWindows(block, *tables[TF])
+                yield (TF,) + _blockHits(block_pos, valid, fwd_scores, rev_scores, threshold)
+
+def scanRegionsMulti(encoded, logodds, regions, threshold, both=True, chunk_size=CHUNK_SIZE):
+    """
+    Scans the given regions of an encoded sequence with several PWMs in a single pass. Motifs are grouped by
+    length, and each group walks the regions once: every block of sequence is gathered and converted once and
+    then scored against all the motifs of the group.
+
+    Args:
+        encoded (np.array): Sequence encoded with encodeSequence()
+        logodds (dict): Mapping of TF name -> log-odds matrix of shape (motif length, 4)
+        regions (array-like or callable): (n, 2) array of [start, end) coordinates, or a function taking a motif
+                                          length and returning the regions to use for motifs of that length
+        threshold (float): Minimum score for a window to count as a hit
+        both (bool): Whether to also scan the negative strand (reverse complement of the motifs)
+        chunk_size (int): Number of windows scored per batch
+
+    Returns:
+        hits (dict): Mapping of TF name -> (positions, scores, strands) arrays, as returned by scanRegions()
+    """
+    found = {TF: [] for TF in logodds}
+    for TF, positions, scores, strands in iterScanRegionsMulti(encoded, logodds, regions, threshold, both, chunk_size):
+        found[TF].append((positions, scores, strands))
+
+    hits = {}
+    for TF, chunks in found.items():
+        if chunks:
+            hits[TF] = tuple(np.concatenate(arrays) for arrays in zip(*chunks))
+        else:
+            hits[TF] = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int8))
+    return hits
+
+def scanRegions(encoded, logodds, regions, threshold, both=True, chunk_size=CHUNK_SIZE):
+    """
+    Scans every window in the given regions of an encoded sequence with a PWM in batched, vectorized calls.
+    Replaces calling motif.pssm.search() on each region separately. A window is a hit if its score is
+    >= threshold (same rule as pssm.search()).
+
+    Args:
+        encoded (np.array): Sequence encoded with encodeSequence()
+        logodds (np.array): Log-odds matrix of shape (motif length, 4), e.g. from pssmToArray()
+        regions (array-like): (n, 2) array of [start, end) coordinates. Only windows fully inside a region are scanned.
+        threshold (float): Minimum score for a window to count as a hit
+        both (bool): Whether to also scan the negative strand (reverse complement of the motif)
+        chunk_size (int): Number of windows scored per batch
+
+    Returns:
+        positions (np.array): int64 start positions of the hits (always positive strand coordinates)
+        scores (np.array): float32 scores of the hits
+        strands (np.array): int8 strand of the hits (1 for positive, -1 for negative)
+    """
+    return scanRegionsMulti(encoded, {None: logodds}, regions, threshold, both, chunk_size)[None]
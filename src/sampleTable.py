@@ -0,0 +1,156 @@
+import os
+import json
+import shutil
+import numpy as np
+
+# CONSTANTS
+
+# columns of a sample table and their types (plus 'seq', the uint8 codes of each sample, of shape (rows, motif length))
+COLUMNS = {
+    "start": np.int64,    # start of the sample on the chromosome (0-based, positive strand coordinates)
+    "end": np.int64,      # end of the sample (exclusive)
+    "strand": np.int8,    # 1 or -1
+    "score": np.float32,  # PWM score of the sample on its strand
+    "label": np.int8,     # 1 for positive (bound) samples, 0 for negative ones
+}
+
+# file holding the TF, chromosome, motif length and number of rows of a table
+META_FILE = "meta.json"
+
+
+def _writeNpy(path, dtype, shape, sources):
+    """
+    Writes a .npy file of a given dtype and shape whose data is the concatenation of the raw bytes of the
+    (path, offset) sources, copied in blocks so the data never has to be in memory.
+    """
+    with open(path + ".tmp", "wb") as out:
+        np.lib.format.write_array_header_1_0(out, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                                   "fortran_order": False, "shape": shape})
+        for source, offset in sources:
+            with open(source, "rb") as f:
+                f.seek(offset)
+                shutil.copyfileobj(f, out, 2**22)
+    os.replace(path + ".tmp", path)
+
+def _dataOffset(npy_file):
+    """
+    Returns the offset of the data of a .npy file (the length of its header).
+    """
+    with open(npy_file, "rb") as f:
+        if np.lib.format.read_magic(f) == (1, 0):
+            np.lib.format.read_array_header_1_0(f)
+        else:
+            np.lib.format.read_array_header_2_0(f)
+        return f.tell()
+
+
+class TableWriter:
+    """
+    Class that writes the samples of a TF on a chromosome as a columnar table: a folder with one .npy file per
+    column (see COLUMNS, plus 'seq' holding the fixed-width encoded sequence of each sample) and a meta.json file.
+    Rows are appended chunk by chunk to raw column files, which are turned into .npy files on close(), so the
+    table can be written while the scan is going and loaded memory-mapped (see loadTable()) with no parsing.
+    Can be used as a context manager, otherwise close() must be called when done.
+    """
+    def __init__(self, folder, TF, chromosome, motif_len):
+        self.folder = folder
+        self.meta = {"tf": TF, "chromosome": chromosome, "motif_len": int(motif_len), "rows": 0}
+        os.makedirs(folder, exist_ok=True)
+        self.files = {name: open(os.path.join(folder, name + ".bin"), "wb") for name in list(COLUMNS) + ["seq"]}
+
+
+    def writeRows(self, starts, strands, scores, label, codes):
+        """
+        Appends a chunk of samples to the table.
+
+        Args:
+            starts (np.array): Start positions of the samples
+            strands (np.array): Strand of each sample (1 or -1)
+            scores (np.array): PWM score of each sample
+            label (int): Label of every sample of the chunk (1 positive, 0 negative)
+            codes (np.array): Encoded sequences of the samples, shape (rows, motif length) (see pwmScanner.encodeWindows())
+        """
+        starts = np.asarray(starts, dtype=COLUMNS["start"])
+        columns = {
+            "start": starts,
+            "end": starts + self.meta["motif_len"],
+            "strand": strands,
+            "score": scores,
+            "label": np.full(len(starts), label),
+        }
+        for name, values in columns.items():
+            self.files[name].write(np.ascontiguousarray(values, dtype=COLUMNS[name]).tobytes())
+        self.files["seq"].write(np.ascontiguousarray(codes, dtype=np.uint8).tobytes())
+        self.meta["rows"] += len(starts)
+
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        rows = self.meta["rows"]
+        for name in self.files:
+            raw = os.path.join(self.folder, name + ".bin")
+            shape = (rows, self.meta["motif_len"]) if name == "seq" else (rows,)
+            _writeNpy(os.path.join(self.folder, name + ".npy"), COLUMNS.get(name, np.uint8), shape, [(raw, 0)])
+            os.remove(raw)
+        with open(os.path.join(self.folder, META_FILE), "w") as f:
+            json.dump(self.meta, f)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def replaceTable(tmp_folder, folder):
+    """
+    Moves a finished table into place, replacing any older table there.
+    """
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    os.replace(tmp_folder, folder)
+
+def loadTable(folder, mmap_mode="r"):
+    """
+    Loads a table written by TableWriter (or mergeTables()), memory-mapped by default so only the parts
+    that are used get read, e.g. table["seq"][table["label"] == 1].
+
+    Returns:
+        (dict): Mapping of column name -> array, plus 'chrom' (the chromosome name, the same for every row)
+                and 'meta' (contents of meta.json)
+    """
+    with open(os.path.join(folder, META_FILE)) as f:
+        meta = json.load(f)
+    table = {name: np.load(os.path.join(folder, name + ".npy"), mmap_mode=mmap_mode) for name in list(COLUMNS) + ["seq"]}
+    table["chrom"] = meta["chromosome"]
+    table["meta"] = meta
+    return table
+
+def mergeTables(folders, out_folder):
+    """
+    Concatenates tables of the same TF and chromosome (e.g. the positive and negative samples of a unit)
+    into a new table, copying the column files block by block.
+
+    Returns:
+        (int): Number of rows of the merged table
+    """
+    metas = []
+    for folder in folders:
+        with open(os.path.join(folder, META_FILE)) as f:
+            metas.append(json.load(f))
+    meta = {**metas[0], "rows": sum(m["rows"] for m in metas)}
+    if any(m["motif_len"] != meta["motif_len"] for m in metas):
+        raise ValueError("can only merge tables with the same motif length")
+
+    os.makedirs(out_folder, exist_ok=True)
+    for name in list(COLUMNS) + ["seq"]:
+        sources = [os.path.join(folder, name + ".npy") for folder in folders]
+        shape = (meta["rows"], meta["motif_len"]) if name == "seq" else (meta["rows"],)
+        _writeNpy(os.path.join(out_folder, name + ".npy"), COLUMNS.get(name, np.uint8), shape,
+                  [(source, _dataOffset(source)) for source in sources])
+    with open(os.path.join(out_folder, META_FILE), "w") as f:
+        json.dump(meta, f)
+    return meta["rows"]
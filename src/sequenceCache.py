@@ -0,0 +1,128 @@
+import os
+from collections import OrderedDict
+import numpy as np
+import pwmScanner as ps
+
+# CONSTANTS
+
+# maximum number of sequences kept in a cache (least recently used ones are dropped first)
+CACHE_SIZE = 2**18
+
+
+def sequenceArray(sequences):
+    """
+    Returns a batch of equal-length sequences (str/bytes, or an (n, L) array of nucleotide codes) as a fixed-width
+    array of uppercase bytes, so identical sequences compare equal however they were given.
+    """
+    if isinstance(sequences, np.ndarray) and sequences.dtype == np.uint8 and sequences.ndim == 2:
+        return ps.windowsToBytes(sequences)
+    return np.array([seq.encode("ascii") if isinstance(seq, str) else bytes(seq) for seq in sequences], dtype=bytes)
+
+
+class SequenceCache:
+    """
+    Class that memoizes a per-sequence computation (features, predictions...) returning one row of values per sequence.
+    Each batch is first deduplicated, then its unique sequences are looked up (hashed by content) in a bounded LRU;
+    only the ones not found are computed, and the rows are broadcast back to every occurrence.
+    If cache_file is given, entries saved there by an earlier run (with the same tag) are loaded, and save()
+    writes the current entries back. The tag should identify the computation (e.g. model and shape table), so a
+    cache file is never reused for a different one.
+    Keeps counts of rows requested, unique rows, cache hits and rows computed (see stats()).
+    """
+    def __init__(self, max_entries=CACHE_SIZE, cache_file=None, tag=""):
+        self.max_entries = max_entries
+        self.cache_file = cache_file
+        self.tag = tag
+        self.entries = OrderedDict()
+        self.requested = self.unique = self.hits = self.computed = 0
+        if cache_file is not None and os.path.isfile(cache_file):
+            self.load(cache_file)
+
+
+    def compute(self, sequences, function):
+        """
+        Returns function(sequences), computing it only for the sequences not already in the cache.
+
+        Args:
+            sequences (array-like): Batch of equal-length sequences (see sequenceArray())
+            function (function): Function taking a bytes array of sequences and returning a 2D array, one row per sequence
+
+        Returns:
+            (np.array): One row of values per sequence, in the order given
+        """
+        seqs = sequenceArray(sequences)
+        if len(seqs) == 0:
+            return np.asarray(function(seqs))
+        uniq, inverse = np.unique(seqs, return_inverse=True)
+        keys = uniq.tolist()
+
+        rows = [self.entries.get(key) for key in keys]
+        found = [i for i, row in enumerate(rows) if row is not None]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        for i in found:
+            self.entries.move_to_end(keys[i])
+
+        values = None
+        if missing:
+            computed = np.asarray(function(uniq[missing]))
+            values = np.empty((len(uniq),) + computed.shape[1:], dtype=computed.dtype)
+            values[missing] = computed
+            # copied row by row, so an entry doesn't keep its whole batch alive
+            for i, row in zip(missing, computed):
+                self.entries[keys[i]] = row.copy()
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        if found:
+            hit_rows = np.stack([rows[i] for i in found])
+            if values is None:
+                values = np.empty((len(uniq),) + hit_rows.shape[1:], dtype=hit_rows.dtype)
+            values[found] = hit_rows
+
+        self.requested += len(seqs)
+        self.unique += len(uniq)
+        self.hits += len(found)
+        self.computed += len(missing)
+        return values[inverse.ravel()]
+
+
+    def stats(self):
+        """
+        Returns the counts of the cache: rows requested, unique rows (per batch), cache hits, rows computed,
+        and the fraction of the rows requested that didn't have to be computed.
+        """
+        return {"requested": self.requested, "unique": self.unique, "hits": self.hits, "computed": self.computed,
+                "saved": 1 - self.computed / self.requested if self.requested else 0.0}
+
+
+    def summary(self):
+        """
+        Returns the stats as one line of text.
+        """
+        s = self.stats()
+        return (f"{s['requested']:,} sequences, {s['unique']:,} unique per batch, {s['hits']:,} cache hits, "
+                f"{s['computed']:,} computed ({s['saved']*100:.1f}% saved)")
+
+
+    def save(self, cache_file=None):
+        """
+        Saves the entries of the cache to a .npz file (default: the cache_file it was created with).
+        """
+        cache_file = cache_file or self.cache_file
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        keys = np.array(list(self.entries), dtype=bytes)
+        values = np.stack(list(self.entries.values())) if self.entries else np.empty((0, 0))
+        with open(cache_file + ".tmp", "wb") as f:
+            np.savez(f, tag=self.tag, keys=keys, values=values)
+        os.replace(cache_file + ".tmp", cache_file)
+
+
+    def load(self, cache_file):
+        """
+        Adds the entries saved in a .npz file by save(), if it was saved with the same tag.
+        """
+        with np.load(cache_file) as saved:
+            if str(saved["tag"]) != self.tag:
+                return
+            keys, values = saved["keys"], saved["values"]
+        for key, row in zip(keys[-self.max_entries:].tolist(), values[-self.max_entries:]):
+            self.entries[key] = row
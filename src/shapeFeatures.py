@@ -0,0 +1,196 @@
+import os
+import numpy as np
+import pwmScanner as ps
+
+# CONSTANTS
+
+# data folder location
+curr = os.path.dirname(__file__)
+DATA_FOLDER = os.path.join(curr, "../data/")
+
+# local pentamer lookup table (same values DNAShape uses), one row per pentamer with a header line:
+# pentamer MGW ProT Roll1 Roll2 HelT1 HelT2
+# Roll1/HelT1 are for the step 5' of the pentamer's central base, Roll2/HelT2 for the step 3' of it.
+# Pentamers missing from the table are filled in from their reverse complement.
+PENTAMER_TABLE = DATA_FOLDER + "pentamerShapes.txt"
+
+# shape features, in the order used everywhere else (mgw, roll, proT, helT)
+SHAPES = ["MGW", "Roll", "ProT", "HelT"]
+
+# table columns needed
+TABLE_COLUMNS = ["MGW", "ProT", "Roll1", "Roll2", "HelT1", "HelT2"]
+
+# weights turning 5 nucleotide codes into a pentamer index (base 4, first base most significant)
+PENTAMER_WEIGHTS = 4**np.arange(4, -1, -1)
+
+# tables already loaded in this process
+_tables = {}
+
+
+def pentamerIndex(pentamer):
+    """
+    Returns the index (0-1023) of a pentamer string in a lookup table.
+    """
+    return int(ps.encodeSequence(pentamer).astype(np.int64) @ PENTAMER_WEIGHTS)
+
+def loadPentamerTable(table_file=PENTAMER_TABLE):
+    """
+    Loads a pentamer shape lookup table into a dict of arrays indexed by pentamerIndex(). Loaded once per process.
+
+    Args:
+        table_file (str): Filepath of the table (whitespace or comma separated, with a header line)
+
+    Returns:
+        table (dict): Mapping of column name (see TABLE_COLUMNS) -> float64 array of 1024 values (NaN if unknown)
+    """
+    if table_file in _tables:
+        return _tables[table_file]
+
+    with open(table_file) as f:
+        rows = [line.replace(',', ' ').split() for line in f if line.strip() and not line.startswith('#')]
+    header = rows[0]
+    table = {name: np.full(4**5, np.nan) for name in TABLE_COLUMNS}
+    for row in rows[1:]:
+        idx = pentamerIndex(row[0].upper())
+        for name in TABLE_COLUMNS:
+            table[name][idx] = float(row[header.index(name)])
+
+    # fill in pentamers only given as their reverse complement: MGW/ProT are the same on both strands,
+    # the 5' and 3' steps of Roll/HelT swap over
+    rc = np.array([pentamerIndex(_reverseComplement(p)) for p in _allPentamers()])
+    for name, rc_name in [("MGW", "MGW"), ("ProT", "ProT"), ("Roll1", "Roll2"), ("Roll2", "Roll1"), ("HelT1", "HelT2"), ("HelT2", "HelT1")]:
+        missing = np.isnan(table[name])
+        table[name][missing] = table[rc_name][rc[missing]]
+
+    _tables[table_file] = table
+    return table
+
+def _allPentamers():
+    codes = (np.arange(4**5)[:, None] // PENTAMER_WEIGHTS) % 4
+    return [bytes(ps.DECODE_TABLE[c]).decode() for c in codes]
+
+def _reverseComplement(seq):
+    return seq[::-1].translate(str.maketrans("ACGT", "TGCA"))
+
+def computeShapes(sequences, table_file=PENTAMER_TABLE):
+    """
+    Computes the MGW, Roll, ProT and HelT of a batch of equal-length sequences from the pentamer lookup table.
+    Vectorized over all samples: every pentamer is turned into a table index and the values gathered in one go.
+    The layout matches the DNAShape files read by helperFunctions.loadPhysicalPropertyArray(): MGW/ProT have one
+    value per base with NaN for the 2 bases at each end, Roll/HelT one value per base-pair step (the average of the
+    two pentamers covering it) with NaN for the first and last step. Windows containing an N give NaN.
+
+    Args:
+        sequences (array-like): Sequences as str/bytes, or an (n, L) array of nucleotide codes from pwmScanner
+        table_file (str): Filepath of the pentamer table
+
+    Returns:
+        shapes (dict): Mapping of 'MGW'/'ProT' -> float32 (n, L) arrays and 'Roll'/'HelT' -> float32 (n, L-1) arrays
+    """
+    table = loadPentamerTable(table_file)
+    codes = encodeBatch(sequences)
+    n, L = codes.shape
+    if (n == 0):
+        return {name: np.empty((0, 0), dtype=np.float32) for name in SHAPES}
+
+    # pentamer index for each central base 2..L-3 (NaN-producing index 1024 where the window has an N)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, 5, axis=1)
+    idx = windows.astype(np.int64) @ PENTAMER_WEIGHTS
+    idx[(windows == ps.N_CODE).any(axis=2)] = 4**5
+    lookup = {name: np.append(values, np.nan)[idx] for name, values in table.items()}
+
+    shapes = {}
+    for name in ["MGW", "ProT"]:
+        shapes[name] = np.full((n, L), np.nan, dtype=np.float32)
+        shapes[name][:, 2:L-2] = lookup[name]
+    for name in ["Roll", "HelT"]:
+        # step s (between bases s and s+1) is the 3' step of the pentamer centred on s and the 5' step of the one on s+1
+        estimates = np.full((2, n, L-1), np.nan)
+        estimates[0, :, 2:L-2] = lookup[name + "2"]
+        estimates[1, :, 1:L-3] = lookup[name + "1"]
+        known = ~np.isnan(estimates)
+        count = known.sum(axis=0)
+        total = np.where(known, estimates, 0).sum(axis=0)
+        shapes[name] = np.where(count > 0, total / np.maximum(count, 1), np.nan).astype(np.float32)
+    return shapes
+
+def cachedShapes(sequences, table_file=PENTAMER_TABLE, cache=None):
+    """
+    computeShapes() memoized by sequence: with a sequenceCache.SequenceCache, each distinct sequence's shapes are only
+    computed once and shared by all its occurrences (in this batch and later ones). Same output as computeShapes().
+    """
+    if cache is None or len(sequences) == 0:
+        return computeShapes(sequences, table_file)
+
+    def packed(seqs):
+        shapes = computeShapes(seqs, table_file)
+        return np.concatenate([shapes[name] for name in SHAPES], axis=1)
+
+    rows = cache.compute(sequences, packed)
+    # rows are MGW (L), Roll (L-1), ProT (L) and HelT (L-1) side by side
+    L = (rows.shape[1] + 2) // 4
+    return dict(zip(SHAPES, np.split(rows, np.cumsum([L, L-1, L])[:3], axis=1)))
+
+def _trimmedShapes(shapes):
+    """
+    Returns each shape (in SHAPES order) without the NaN ends, which are the same for every sample.
+    """
+    trimmed = []
+    for name in SHAPES:
+        values = np.asarray(shapes[name], dtype=np.float64)
+        ends = 2 if name in ("MGW", "ProT") else 1
+        trimmed.append(values[:, ends:values.shape[1]-ends])
+    return trimmed
+
+def averageShapes(shapes):
+    """
+    Averages each shape over the positions of every sample, giving the same (n, 4) features matrix as
+    helperFunctions.getFeatsAveraged() (columns mgw, roll, proT, helT) but computed sample by sample,
+    so the result doesn't depend on which other samples are in the batch. Samples with an N give NaN.
+
+    Args:
+        shapes (dict): Output of computeShapes()
+
+    Returns:
+        (np.array): float64 features matrix of shape (n, 4)
+    """
+    return np.column_stack([values.mean(axis=1) for values in _trimmedShapes(shapes)])
+
+def concatShapes(shapes):
+    """
+    Concatenates every position of every shape into one features matrix, the same (unscaled) columns as
+    helperFunctions.getFeatsScaled() (mgw, roll, proT, helT). Computed sample by sample like averageShapes().
+
+    Args:
+        shapes (dict): Output of computeShapes()
+
+    Returns:
+        (np.array): float64 features matrix of shape (n, 4*L - 10) for sequences of length L
+    """
+    return np.concatenate(_trimmedShapes(shapes), axis=1)
+
+def encodeBatch(sequences):
+    """
+    Encodes a batch of equal-length sequences (str/bytes, or already an array of codes) as an (n, L) uint8 array.
+    """
+    if isinstance(sequences, np.ndarray) and sequences.dtype == np.uint8 and sequences.ndim == 2:
+        return sequences
+    sequences = [s.encode("ascii") if isinstance(s, str) else bytes(s) for s in sequences]
+    if not sequences:
+        return np.empty((0, 0), dtype=np.uint8)
+    raw = np.frombuffer(b"".join(sequences), dtype=np.uint8)
+    return ps.ENCODE_TABLE[raw].reshape(len(sequences), -1)
+
+def saveShapes(shapes_file, shapes):
+    """
+    Saves the output of computeShapes() to a binary .npz file.
+    """
+    np.savez(shapes_file, **shapes)
+
+def loadShapes(shapes_file):
+    """
+    Loads shapes saved with saveShapes(), returned in the order (mgw, roll, proT, helT) as taken by
+    the helperFunctions.getFeats*() functions.
+    """
+    with np.load(shapes_file) as shapes:
+        return [shapes[name] for name in SHAPES]
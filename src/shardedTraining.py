@@ -0,0 +1,310 @@
+import os
+import glob
+import gzip
+import time
+import argparse
+import itertools
+import numpy as np
+from sklearn.base import clone
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import BernoulliNB, GaussianNB
+import helperFunctions as hf
+import instrumentation as ins
+import shapeFeatures as sf
+import predictSites as pst
+import sequenceCache as sc
+import modelExploration as me
+
+# CONSTANTS
+
+# folder locations
+curr = os.path.dirname(__file__)
+OUT_FOLDER = os.path.join(curr, "../outputs/")
+# feature shards are written here (shard_00000.npz, shard_00001.npz, ...)
+SHARD_FOLDER = OUT_FOLDER + "shards/"
+
+# number of samples per shard, which bounds the memory used while writing shards and training
+SHARD_SIZE = 2**16
+
+# number of passes over the shards
+EPOCHS = 5
+
+# fraction of the samples of every shard held out for evaluation
+TEST_FRACTION = 0.2
+
+# seed of the shard shuffling and the held out samples
+SEED = 0
+
+# models that can learn shard by shard (partial_fit)
+models = [
+    SGDClassifier(loss="log_loss", random_state=SEED),
+    SGDClassifier(loss="hinge", random_state=SEED),
+    SGDClassifier(loss="modified_huber", random_state=SEED),
+    BernoulliNB(),
+    GaussianNB()
+]
+
+# models whose partial_fit() accumulates counts, so they only see the training samples once (on the first epoch)
+SINGLE_PASS = (BernoulliNB, GaussianNB)
+
+
+def countSamples(sample_files):
+    """
+    Returns the number of samples in a list of sample files: FASTA files from extractSamples.py ('>label' lines
+    are skipped, gzipped if they end in '.gz'), unit files (one sequence per line) or DNAShape text files.
+    """
+    n = 0
+    for sample_file in sample_files:
+        opener = gzip.open if sample_file.endswith(".gz") else open
+        with opener(sample_file, "rb") as f:
+            n += sum(1 for line in f if line.strip() and not line.startswith(b">"))
+    return n
+
+def _lines(sample_file):
+    """
+    Yields the non-empty, non-label lines of a sample file.
+    """
+    opener = gzip.open if sample_file.endswith(".gz") else open
+    with opener(sample_file, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith(b">"):
+                yield line
+
+def sequenceChunks(sample_files, chunk_size, table_file=sf.PENTAMER_TABLE, cache=None):
+    """
+    Reads the sequences of sample files chunk_size at a time and yields the DNA shapes of each chunk
+    (see shapeFeatures.computeShapes()). With a sequenceCache.SequenceCache, repeated sequences are only computed once.
+    """
+    lines = itertools.chain.from_iterable(_lines(sample_file) for sample_file in sample_files)
+    while True:
+        sequences = list(itertools.islice(lines, chunk_size))
+        if not sequences:
+            break
+        yield sf.cachedShapes(sequences, table_file, cache)
+
+def shapeFileChunks(shape_files, chunk_size):
+    """
+    Reads a set of DNAShape text files (MGW, Roll, ProT, HelT, one line of comma-separated values per sample)
+    chunk_size samples at a time and yields each chunk's shapes in the same format as shapeFeatures.computeShapes().
+    """
+    readers = [_lines(shape_file) for shape_file in shape_files]
+    while True:
+        chunk = [list(itertools.islice(reader, chunk_size)) for reader in readers]
+        if not chunk[0]:
+            break
+        yield {name: np.array([[np.nan if v == b"NA" else float(v) for v in line.split(b",")] for line in lines], dtype=np.float32)
+               for name, lines in zip(sf.SHAPES, chunk)}
+
+def writeShards(pos_chunks, neg_chunks, shard_folder=SHARD_FOLDER, featurize=sf.averageShapes, seed=SEED):
+    """
+    Featurizes the positive and negative samples chunk by chunk and writes them to shards on disk, each one holding
+    one chunk of positives and one of negatives (so every shard has about the same class balance as the whole set)
+    in a shuffled order. Samples that can't be featurized (e.g. containing an N) are dropped.
+    Old shards in the folder are removed first.
+
+    Args:
+        pos_chunks (iterable): Shapes of the positive samples, one chunk per shard (from sequenceChunks() or shapeFileChunks())
+        neg_chunks (iterable): Shapes of the negative samples, one chunk per shard
+        shard_folder (str): Folder to write the shards to
+        featurize (function): Function turning shapes into a features matrix (a value of predictSites.FEATURIZERS)
+        seed (int): Seed of the shuffling
+
+    Returns:
+        n_samples (int): Number of samples written
+        n_dropped (int): Number of samples dropped
+    """
+    os.makedirs(shard_folder, exist_ok=True)
+    for old in glob.glob(os.path.join(shard_folder, "shard_*.npz")):
+        os.remove(old)
+
+    n_samples, n_dropped = 0, 0
+    for i, (pos, neg) in enumerate(itertools.zip_longest(pos_chunks, neg_chunks)):
+        parts = [(featurize(shapes), label) for shapes, label in ((pos, 1), (neg, 0)) if shapes is not None]
+        X = np.concatenate([feats for feats, _ in parts]).astype(np.float32)
+        y = np.concatenate([np.full(len(feats), label, dtype=np.int8) for feats, label in parts])
+
+        ok = ~np.isnan(X).any(axis=1)
+        order = np.random.default_rng([seed, i]).permutation(int(ok.sum()))
+        np.savez(os.path.join(shard_folder, f"shard_{i:05d}.npz"), X=X[ok][order], y=y[ok][order])
+        n_samples += int(ok.sum())
+        n_dropped += int((~ok).sum())
+    return n_samples, n_dropped
+
+def chunkSizes(n_pos, n_neg, shard_size=SHARD_SIZE):
+    """
+    Returns the positive and negative chunk sizes splitting both sets over the same number of shards of about shard_size samples.
+    """
+    n_shards = max(1, -(-(n_pos + n_neg) // shard_size))
+    return max(1, -(-n_pos // n_shards)), max(1, -(-n_neg // n_shards))
+
+def iterShards(shard_folder=SHARD_FOLDER, test_fraction=TEST_FRACTION, seed=SEED, shuffle=None):
+    """
+    Yields the shards of a folder one at a time, split into training and held out samples. The held out samples of
+    a shard are the same on every pass (they depend only on seed and the shard's index).
+
+    Args:
+        shard_folder (str): Folder of the shards written by writeShards()
+        test_fraction (float): Fraction of the samples held out
+        seed (int): Seed of the held out samples
+        shuffle (np.random.Generator): If given, the shards and the samples within them are visited in a random order
+
+    Yields:
+        X_train, y_train, X_test, y_test (np.array): The samples of one shard
+    """
+    shard_files = sorted(glob.glob(os.path.join(shard_folder, "shard_*.npz")))
+    if not shard_files:
+        raise FileNotFoundError(f"no shards in {shard_folder}")
+    order = shuffle.permutation(len(shard_files)) if shuffle is not None else range(len(shard_files))
+    for i in order:
+        with np.load(shard_files[i]) as shard:
+            X, y = shard["X"], shard["y"]
+        test = np.random.default_rng([seed, int(i)]).random(len(y)) < test_fraction
+        train_idx = np.flatnonzero(~test)
+        if shuffle is not None:
+            train_idx = shuffle.permutation(train_idx)
+        yield X[train_idx], y[train_idx], X[test], y[test]
+
+def fitScaler(shard_folder=SHARD_FOLDER, test_fraction=TEST_FRACTION, seed=SEED):
+    """
+    Fits a StandardScaler on the training samples of every shard with partial_fit(), one shard at a time.
+    """
+    scaler = StandardScaler()
+    for X_train, _, _, _ in iterShards(shard_folder, test_fraction, seed):
+        if len(X_train):
+            scaler.partial_fit(X_train)
+    return scaler
+
+def trainSharded(models, shard_folder=SHARD_FOLDER, epochs=EPOCHS, test_fraction=TEST_FRACTION, seed=SEED):
+    """
+    Trains models out of core: the scaler is fitted incrementally over the shards, then every model learns from
+    the shards one at a time with partial_fit(), for a number of passes over the shards (epochs). Only one shard is
+    in memory at a time, so memory use doesn't grow with the size of the dataset. Models are evaluated on the
+    held out samples of every shard, with the scores computed from confusion counts added up shard by shard.
+
+    Args:
+        models (list): Unfitted sklearn models supporting partial_fit(), cloned before fitting
+        shard_folder (str): Folder of the shards written by writeShards()
+        epochs (int): Number of passes over the shards (models in SINGLE_PASS only learn on the first)
+        test_fraction (float): Fraction of the samples of every shard held out for evaluation
+        seed (int): Seed of the held out samples and the order of the passes
+
+    Returns:
+        fitted (list): A fitted pipeline (scaler + model) per model
+        results (list): A dict of scores (accuracy, f1, precision, recall) and fit time (s) per model
+    """
+    classes = np.array([0, 1])
+    scaler = fitScaler(shard_folder, test_fraction, seed)
+    if not hasattr(scaler, "n_samples_seen_"):
+        raise ValueError(f"no training samples in the shards of {shard_folder}")
+    fitted = [clone(model) for model in models]
+    fit_times = np.zeros(len(models))
+
+    rng = np.random.default_rng(seed)
+    for epoch in range(epochs):
+        for X_train, y_train, _, _ in iterShards(shard_folder, test_fraction, seed, shuffle=rng):
+            if not len(y_train):
+                continue
+            X_train = scaler.transform(X_train)
+            for m, model in enumerate(fitted):
+                if epoch > 0 and isinstance(model, SINGLE_PASS):
+                    continue
+                start = time.perf_counter()
+                model.partial_fit(X_train, y_train, classes=classes)
+                fit_times[m] += time.perf_counter() - start
+
+    # confusion counts (tn, fp, fn, tp) of every model over all the held out samples
+    counts = np.zeros((len(models), 4), dtype=np.int64)
+    for _, _, X_test, y_test in iterShards(shard_folder, test_fraction, seed):
+        if not len(y_test):
+            continue
+        X_test = scaler.transform(X_test)
+        for m, model in enumerate(fitted):
+            counts[m] += np.bincount(2 * y_test.astype(np.int64) + model.predict(X_test).astype(np.int64), minlength=4)
+
+    results = []
+    for model, (tn, fp, fn, tp), fit_time in zip(fitted, counts, fit_times):
+        results.append({
+            "model": type(model).__name__ + (f"({model.loss})" if isinstance(model, SGDClassifier) else ""),
+            "fit_time": fit_time,
+            "accuracy": (tp + tn) / max(tn + fp + fn + tp, 1),
+            "f1": 2 * tp / max(2 * tp + fp + fn, 1),
+            "precision": tp / max(tp + fp, 1),
+            "recall": tp / max(tp + fn, 1),
+        })
+    return [make_pipeline(scaler, model) for model in fitted], results
+
+def parseArgs(argv=None):
+    """
+    Parses the command line arguments. Defaults are the constants at the top of this file and modelExploration.py.
+    """
+    parser = argparse.ArgumentParser(description="Train models out of core, from feature shards on disk.")
+    parser.add_argument("--pos", nargs="+", default=None,
+                        help="positive sample files: FASTA/unit files from extractSamples.py, or with --dnashape the "
+                             "MGW, Roll, ProT and HelT files (default: the DNAShape files of modelExploration.py)")
+    parser.add_argument("--neg", nargs="+", default=None, help="negative sample files, as --pos")
+    parser.add_argument("--dnashape", action="store_true", help="--pos/--neg are DNAShape text files (MGW, Roll, ProT, HelT)")
+    parser.add_argument("--features", choices=sorted(pst.FEATURIZERS), default="averaged", help="featurization of the shapes")
+    parser.add_argument("--shape-table", default=sf.PENTAMER_TABLE, help="pentamer shape table (for sequence files)")
+    parser.add_argument("--cache-size", type=int, default=sc.CACHE_SIZE,
+                        help="number of unique sequences whose shapes are memoized (0 disables)")
+    parser.add_argument("--shard-dir", default=SHARD_FOLDER, help="folder of the feature shards")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="number of samples per shard")
+    parser.add_argument("--reuse-shards", action="store_true", help="train on the shards already in --shard-dir")
+    parser.add_argument("--epochs", type=int, default=EPOCHS, help="number of passes over the shards")
+    parser.add_argument("--test-fraction", type=float, default=TEST_FRACTION, help="fraction of the samples held out")
+    parser.add_argument("--seed", type=int, default=SEED, help="seed of the shuffling and held out samples")
+    parser.add_argument("--save", default=None, metavar="MODEL",
+                        help="name of the model (as printed, e.g. 'SGDClassifier(log_loss)') to save for predictSites.py")
+    parser.add_argument("--model-file", default=pst.MODEL_FILE, help="where to save it")
+    args = parser.parse_args(argv)
+    if args.pos is None and args.neg is None:
+        args.pos = [me.MGW_FILE_POS, me.ROLL_FILE_POS, me.PROT_FILE_POS, me.HELT_FILE_POS]
+        args.neg = [me.MGW_FILE_NEG, me.ROLL_FILE_NEG, me.PROT_FILE_NEG, me.HELT_FILE_NEG]
+        args.dnashape = True
+    if args.pos is None or args.neg is None:
+        parser.error("--pos and --neg must be given together")
+    if args.dnashape and (len(args.pos) != 4 or len(args.neg) != 4):
+        parser.error("--dnashape needs the 4 files (MGW, Roll, ProT, HelT) for --pos and for --neg")
+    return args
+
+def main(argv=None):
+    args = parseArgs(argv)
+    start = time.time()
+
+    if not args.reuse_shards:
+        # DNAShape sets have one line per sample in each of their 4 files, so count the first one
+        n_pos = countSamples(args.pos[:1] if args.dnashape else args.pos)
+        n_neg = countSamples(args.neg[:1] if args.dnashape else args.neg)
+        pos_size, neg_size = chunkSizes(n_pos, n_neg, args.shard_size)
+        if args.dnashape:
+            pos_chunks, neg_chunks = shapeFileChunks(args.pos, pos_size), shapeFileChunks(args.neg, neg_size)
+        else:
+            # one cache for both classes, positives and negatives often share sequences
+            cache = sc.SequenceCache(args.cache_size) if args.cache_size > 0 else None
+            pos_chunks = sequenceChunks(args.pos, pos_size, args.shape_table, cache)
+            neg_chunks = sequenceChunks(args.neg, neg_size, args.shape_table, cache)
+        n_samples, n_dropped = writeShards(pos_chunks, neg_chunks, args.shard_dir, pst.FEATURIZERS[args.features], args.seed)
+        print(f"{n_samples:,} samples ({n_pos:,} pos, {n_neg:,} neg, {n_dropped:,} dropped) written to shards in {args.shard_dir}")
+        if not args.dnashape and cache is not None:
+            print(f"Shape cache: {cache.summary()}")
+
+    fitted, results = trainSharded(models, args.shard_dir, args.epochs, args.test_fraction, args.seed)
+    for result in results:
+        print(f"{result['model']:<34} acc {result['accuracy']*100:7.3f}%   f1 {result['f1']*100:7.3f}%   "
+              f"pre {result['precision']*100:7.3f}%   rec {result['recall']*100:7.3f}%   fit {result['fit_time']:.2f}s")
+
+    if args.save:
+        names = [result["model"] for result in results]
+        if args.save not in names:
+            raise ValueError(f"unknown model {args.save}, choose one of: {', '.join(names)}")
+        pst.saveModel(fitted[names.index(args.save)], args.model_file, features=args.features)
+        print(f"Saved {args.save} to {args.model_file}")
+
+    print(f"\nPeak memory: {ins.peakRss():,.0f} MB")
+    print(f"Total time elapsed: {hf.stringTime(start, time.time())}")
+
+if (__name__=="__main__"):
+    main()